@@ -2,34 +2,124 @@
 #
 # Asset allocation logic for SFC
 # 
-from risk_report.geneva import isGenevaPosition, getGenevaAssetType
-from risk_report.data import getRatingScoreMapping, getCountryMapping, getAssetTypeSpecialCaseData \
+from risk_report.geneva import getGenevaAssetType
+from risk_report.data import getCountryGroupTable, getAssetTypeSpecialCaseData \
 							, getPortfolioId, getIdnType, isPrivateSecurity, isCash \
-							, isMoneyMarket, isRepo, isFxForward, isFund
+							, isMoneyMarket, isRepo, isFxForward, isFund, isFromGeneva, SecurityRecord
+from risk_report.instrument import timed
 from steven_utils.iter import pop, firstOf
 from steven_utils.utility import mergeDict
 from toolz.functoolz import compose
-from functools import partial, lru_cache
+from functools import partial, reduce, lru_cache, wraps
 from itertools import filterfalse, takewhile
+from array import array
 import logging
 logger = logging.getLogger(__name__)
 
 
 
+"""
+	The classification of a security (asset type, country code, country group,
+	rating score and attributes) does not change within a date, so each of
+	them is computed once and saved in a classification table, later calls
+	are a dictionary lookup.
+
+	A blpData object is loaded once per date (getBlpData() is cached), so we
+	keep one classification table per blpData object. The blpData object is
+	also kept, so that its id() is not reused by another object.
+"""
+_classificationTables = {}
+
+
+
+def getClassificationTable(blpData):
+	"""
+	[Dictionary] blpData
+		=> [Dictionary] security key -> [Dictionary] classification record
+	"""
+	key = id(blpData)
+	if not key in _classificationTables:
+		if len(_classificationTables) >= 3:	# only keep the latest 3 tables
+			_classificationTables.pop(next(iter(_classificationTables)))
+
+		_classificationTables[key] = (blpData, {})
+
+	return _classificationTables[key][1]
+
+
+
+"""
+	[Dictionary] position => [Tuple] (id, idType, portfolio id)
+
+	Special cases are by portfolio, therefore the portfolio id is part of the
+	security key.
+"""
+getSecurityKey = lambda position: (*getIdnType(position), getPortfolioId(position))
+
+
+
+"""
+	[Dictionary] blpData, [Dictionary] position
+		=> [Dictionary] classification record of the security, containing
+			the fields that have been resolved so far
+"""
+getClassification = lambda blpData, position: \
+	getClassificationTable(blpData).setdefault(getSecurityKey(position), {})
+
+
+
+def classified(field):
+	"""
+	[String] field => [Function] decorator
+
+	Decorate a function f(blpData, position), so that its result is saved
+	under the field in the classification record of the security. If f raises
+	an exception, nothing is saved.
+	"""
+	def decorator(func):
+		@wraps(func)
+		def wrapper(blpData, position):
+			record = getClassification(blpData, position)
+			if not field in record:
+				record[field] = func(blpData, position)
+
+			return record[field]
+
+		return wrapper
+
+	return decorator
+
+
+
 def byCountryGroup(blpData, countryGroup, positions):
 	"""
 	[Dictionary] blpData, [String] countryGroup, [Iterator] positions
 		=> [Iterator] positions from that country group
+
+	A position is from the country group if the country group starts with the
+	position's country group (case insensitive). The matching country groups
+	are found once per country group, see getCountryGroupMatches().
 	"""
-	matchCountryGroup = lambda blpData, countryGroup, position: \
-		countryGroup.lower().startswith(toCountryGroup(blpData, position).lower())
+	matches = getCountryGroupMatches(countryGroup)
+	return filter(lambda position: matches[getCountryGroupCode(blpData, position)], positions)
+# End of byCountryGroup
 
 
-	return filter(partial(matchCountryGroup, blpData, countryGroup), positions)
-# End of byCountryGroup
+
+@lru_cache(maxsize=256)
+def getCountryGroupMatches(countryGroup):
+	"""
+	[String] countryGroup (e.g., a column of the SFC template)
+		=> [Array] country group code -> 1 if the country group starts with
+			that country group (case insensitive), otherwise 0
+	"""
+	return array('b', map( lambda group: countryGroup.lower().startswith(group.lower())
+						 , getCountryGroupTable()['Groups']))
 
 
 
+@timed('getAssetType')
+@classified('AssetType')
 def getAssetType(blpData, position):
 	"""
 	[Dictionary] position (a Geneva or Blp position)
@@ -41,7 +131,7 @@ def getAssetType(blpData, position):
 	logger.debug('getAssetType(): {0}'.format(getIdnType(position)))
 
 	return \
-	getSpecialCaseAssetType(position) if isSpecialCase(position) else \
+	getSpecialCaseAssetType(blpData, position) if isSpecialCase(blpData, position) else \
 	getPrivateSecurityAssetType(position) if isPrivateSecurity(position) else \
 	('Cash', ) if isCash(position) else \
 	('Foreign Exchange Derivatives', ) if isFxForward(position) else \
@@ -65,7 +155,7 @@ def getFundAssetType(position):
 		lognRaise('toAssetTypeGeneva(): unsupported {0}'.format(tp))
 
 	return \
-	toAssetTypeGeneva(getGenevaAssetType(position)) if isGenevaPosition(position) \
+	toAssetTypeGeneva(getGenevaAssetType(position)) if isFromGeneva(position) \
 	else lognRaise('getFundAssetType(): Bloomberg asset not supported yet')
 
 
@@ -157,40 +247,57 @@ def getPrivateSecurityAssetType(position):
 	"""
 	# FIXME: add implementation
 	logger.debug('getPrivateSecurityAssetType()')
-	raise ValueError
+	raise ValueError('getPrivateSecurityAssetType(): private security not supported')
 
 
 
-""" [Dictionary] position => [Tuple] asset type """
-getSpecialCaseAssetType = lambda position: \
-	getAssetTypeSpecialCaseData()[getIdnType(position)[0]]['AssetType']
+@classified('SpecialCase')
+def getAssetTypeSpecialCase(blpData, position):
+	"""
+	[Dictionary] blpData (or security master), [Dictionary] position
+		=> [Dictionary] asset type special case of the security, or None if
+			there is none for the position's portfolio
 
+	With a security master (see data.getSecurityMaster()), the special case
+	comes from the security's record, so all sources are looked up at once.
+	"""
+	portfolioMatched = lambda p1, p2: True if p2 == '' or p1 == p2 else False
 
+	securityId = getIdnType(position)[0]
+	record = blpData.get(securityId)
+	specialCase = record.assetTypeSpecialCase if isinstance(record, SecurityRecord) else \
+					getAssetTypeSpecialCaseData().get(securityId)
 
-""" [Dictionary] position => [String] country """
-getSpecialCaseCountry = lambda position: \
-	getAssetTypeSpecialCaseData()[getIdnType(position)[0]]['CountryCode']
+	return \
+	specialCase if specialCase != None \
+		and portfolioMatched(getPortfolioId(position), specialCase['Portfolio']) else \
+	None
 
 
 
-def isSpecialCase(position):
-	"""
-	[Dictionary] position => [Bool] is this a special case in asset type,
-								private security, open ended fund or something
-								that needs override.
-	"""
-	portfolioMatched = lambda p1, p2: True if p2 == '' or p1 == p2 else False
+""" [Dictionary] blpData, [Dictionary] position => [Tuple] asset type """
+getSpecialCaseAssetType = lambda blpData, position: \
+	getAssetTypeSpecialCase(blpData, position)['AssetType']
+
+
+
+""" [Dictionary] blpData, [Dictionary] position => [String] country """
+getSpecialCaseCountry = lambda blpData, position: \
+	getAssetTypeSpecialCase(blpData, position)['CountryCode']
+
+
 
-	return compose(
-		lambda t: t[0] in t[2] and portfolioMatched(t[1], t[2][t[0]]['Portfolio'])
-	  , lambda position: ( getIdnType(position)[0]
-	  					 , getPortfolioId(position)
-	  					 , getAssetTypeSpecialCaseData()
-	  					 )
-	)(position)
+"""
+	[Dictionary] blpData, [Dictionary] position
+		=> [Bool] is this a special case in asset type, private security, open
+			ended fund or something that needs override.
+"""
+isSpecialCase = lambda blpData, position: \
+	getAssetTypeSpecialCase(blpData, position) != None
 
 
 
+@classified('CountryCode')
 def getCountryCode(blpData, position):
 	"""
 	[Dictionary] blpInfo, [Dictionary] position => [String] country code
@@ -218,7 +325,7 @@ def getCountryCode(blpData, position):
 
 
 	return \
-	getSpecialCaseCountry(position) if isSpecialCase(position) else \
+	getSpecialCaseCountry(blpData, position) if isSpecialCase(blpData, position) else \
 	getPrivateSecurityCountry(position) if isPrivateSecurity(position) else \
 	getRepoCountry(position) if isRepo(position) else \
 	getMoneyMarketCountry(position) if isMoneyMarket(position) else \
@@ -335,15 +442,27 @@ def getFundCountry(blpData, position):
 """
 	[Dictionary] blpData, [Dictionary] position => [String] country group
 """
-toCountryGroup = compose(
-	lambda code: \
-		getCountryMapping()[code] if code in getCountryMapping() else \
-		lognRaise('toCountryGroup(): unsupported country code: {0}'.format(code))
-  , getCountryCode
+toCountryGroup = classified('CountryGroup')(
+	lambda blpData, position: \
+		getCountryGroupTable()['Groups'][getCountryGroupCode(blpData, position)]
 )
 
 
 
+"""
+	[Dictionary] blpData, [Dictionary] position
+		=> [Int] country group code, see data.getCountryGroupTable()
+"""
+getCountryGroupCode = classified('CountryGroupCode')(compose(
+	lambda t: \
+		t[1] if t[1] != None else \
+		lognRaise('toCountryGroup(): unsupported country code: {0}'.format(t[0]))
+  , lambda code: (code, getCountryGroupTable()['Codes'].get(code))
+  , getCountryCode
+))
+
+
+
 def getAverageRatingScoreSpecialCase(position):
 	"""
 	[Dictionary] position => [Float] score
@@ -362,22 +481,53 @@ def getAverageRatingScore(blpData, position, specialCaseHandler=getAverageRating
 	"""
 	[Dictionary] blpData, [Dictionary] position
 		=> [Float] score
+
+	With the default special case handler, the score is saved in the
+	classification table. A different handler is always called, because
+	it may have side effects (see main.getFISecuritiesWoRatings()).
 	"""
-	logger.debug('getAverageRatingScore(): {0}'.format(getIdnType(position)))
+	return \
+	getAverageRatingScoreClassified(blpData, position) \
+	if specialCaseHandler == getAverageRatingScoreSpecialCase else \
+	computeAverageRatingScore(blpData, position, specialCaseHandler)
 
-	averageScore = lambda position, scores: \
-		specialCaseHandler(position) if len(scores) == 0 else \
-		scores[0] if len(scores) == 1 else \
-		min(scores) if len(scores) == 2 else \
-		sorted(scores)[1]
 
 
+def computeAverageRatingScore(blpData, position, specialCaseHandler):
+	"""
+	[Dictionary] blpData, [Dictionary] position, [Function] specialCaseHandler
+		=> [Float] score
+
+	The average score is computed when BlpData is loaded (see
+	data.toRatingRecords()), the special case handler is called when no
+	agency gives a rating.
+	"""
+	logger.debug('computeAverageRatingScore(): {0}'.format(getIdnType(position)))
+
+	record = getRatingRecord(blpData, position)
+
 	return \
-	compose(
-		partial(averageScore, position)
-	  , lambda scores: list(filterfalse(lambda x: x == 0, scores))
-	  , getRatingScores
-	)(blpData, position)
+	lognRaise('computeAverageRatingScore(): unsupported rating: {0}'.format(getIdnType(position))) \
+	if None in record.scores else \
+	specialCaseHandler(position) if record.average == None else \
+	record.average
+
+
+
+""" [Dictionary] blpData, [Dictionary] position => [Float] score """
+getAverageRatingScoreClassified = classified('RatingScore')(
+	lambda blpData, position: \
+		computeAverageRatingScore(blpData, position, getAverageRatingScoreSpecialCase)
+)
+
+
+
+"""
+	[Dictionary] blpData, [Dictionary] position
+		=> [RatingRecord] rating scores of the security, see data.getBlpData()
+"""
+getRatingRecord = lambda blpData, position: \
+	blpData[getIdnType(position)[0]]['RatingRecord']
 
 
 
@@ -389,18 +539,12 @@ def getAverageRatingScore(blpData, position, specialCaseHandler=getAverageRating
 				   )
 """
 getRatingScores = lambda blpData, position: \
-	( getRatingScore('S&P', blpData[getIdnType(position)[0]]['RTG_SP'])
-	, getRatingScore('Moody\'s', blpData[getIdnType(position)[0]]['RTG_MOODY'])
-	, getRatingScore('Fitch', blpData[getIdnType(position)[0]]['RTG_FITCH'])
-	)
+	getRatingRecord(blpData, position).scores
 
 
 
-"""
-	[String] agency, [String] rating => [Float] rating score
-"""
-getRatingScore = lambda agency, rating: \
-	0 if rating.startswith('#N/A') else getRatingScoreMapping()[(agency, rating)]
+""" The lowest average rating score of an investment grade security """
+investmentGradeScore = 12
 
 
 
@@ -408,8 +552,10 @@ getRatingScore = lambda agency, rating: \
 	[Dictionary] blpData, [Dictionary] position
 			=> [Bool] is investment grade position
 """
-isInvestmentGrade = lambda blpData, position: \
-	False if getAverageRatingScore(blpData, position) < 12 else True
+isInvestmentGrade = classified('InvestmentGrade')(
+	lambda blpData, position: \
+		False if getAverageRatingScore(blpData, position) < investmentGradeScore else True
+)
 
 
 
@@ -417,8 +563,10 @@ isInvestmentGrade = lambda blpData, position: \
 	[Dictionary] blpData, [Dictionary] position
 			=> [Bool] is investment financial industry
 """
-isFinancial = lambda blpData, position: \
-	True if blpData[getIdnType(position)[0]]['INDUSTRY_SECTOR'] == 'Financial' else False
+isFinancial = classified('Financial')(
+	lambda blpData, position: \
+		True if blpData[getIdnType(position)[0]]['INDUSTRY_SECTOR'] == 'Financial' else False
+)
 
 
 
@@ -428,9 +576,11 @@ isFinancial = lambda blpData, position: \
 
 	# FIXME: rely on hardcoded special cases
 """
-isSFCAuthorized = lambda blpData, position: \
-	False if getIdnType(position)[0] == '.FSFUND HK Equity' else \
-	True if blpData[getIdnType(position)[0]]['SFC_AUTHORIZED_FUND'] == 'Y' else False
+isSFCAuthorized = classified('SFCAuthorized')(
+	lambda blpData, position: \
+		False if getIdnType(position)[0] == '.FSFUND HK Equity' else \
+		True if blpData[getIdnType(position)[0]]['SFC_AUTHORIZED_FUND'] == 'Y' else False
+)
 
 
 
@@ -536,6 +686,43 @@ byCountryFilter = lambda blpData, countryGroup: \
 
 
 
+"""
+	[Tuple] t1 (asset type strings from template), [Tuple] t2 (asset type)
+		=> [Bool] does every string in t1 start with the counterpart in t2
+"""
+assetTypeMatched = lambda t1, t2: \
+	False if len(t1) > len(t2) else \
+	all(map(lambda t: t[0].lower().startswith(t[1].lower()), zip(t1, t2)))
+
+
+
+"""
+	Attributes in an asset type tuple, each maps to a function
+	f([Dictionary] blpData, [Dictionary] position) => [Bool]
+"""
+attributeFunctions = \
+{ 'investment grade': isInvestmentGrade
+, 'non-investment grade': lambda blpData, p: not isInvestmentGrade(blpData, p)
+, 'financial': isFinancial
+, 'non-financial': lambda blpData, p: not isFinancial(blpData, p)
+, 'sfc authorized': isSFCAuthorized
+, 'non-sfc authorized': lambda blpData, p: not isSFCAuthorized(blpData, p)
+}
+
+
+
+"""
+	[String] string => [Function] attribute function if string matches one of
+		the attributes, else None
+"""
+getAttributeFunction = lru_cache(maxsize=256)(compose(
+	partial(firstOf, lambda f: f != None)
+  , lambda s: map( lambda key: attributeFunctions[key] if s.lower().startswith(key) else None
+  		   		 , attributeFunctions.keys())
+))
+
+
+
 def fallsInAssetType(blpData, assetTypeTuple, position):
 	"""
 	[Tuple] assetTypeTuple, [Dictionary] position
@@ -553,35 +740,226 @@ def fallsInAssetType(blpData, assetTypeTuple, position):
 
 	('Fund', 'Exchange Traded Funds', 'SFC Authorized')
 	"""
-	assetTypeMatched = lambda t1, t2: \
-		False if len(t1) > len(t2) else \
-		all(map(lambda t: t[0].lower().startswith(t[1].lower()), zip(t1, t2)))
+	return \
+	True if len(assetTypeTuple) == 0 else \
+	fallsInAssetType(blpData, assetTypeTuple[:-1], position) and getAttributeFunction(assetTypeTuple[-1])(blpData, position) \
+	if getAttributeFunction(assetTypeTuple[-1]) != None else \
+	assetTypeMatched(assetTypeTuple, getAssetType(blpData, position))
+
 
 
-	attributeFunctions = \
-	{ 'investment grade': partial(isInvestmentGrade, blpData)
-	, 'non-investment grade': lambda p: not isInvestmentGrade(blpData, p)
-	, 'financial': partial(isFinancial, blpData)
-	, 'non-financial': lambda p: not isFinancial(blpData, p)
-	, 'sfc authorized': partial(isSFCAuthorized, blpData)
-	, 'non-sfc authorized': lambda p: not isSFCAuthorized(blpData, p)
+def compileAssetTypeRow(assetTypeTuple):
+	"""
+	[Tuple] assetTypeTuple
+		=> ( [Tuple] assetTypeTuple
+		   , [Tuple] asset type strings
+		   , [Tuple] attribute functions
+		   )
+
+	Split the attributes at the end of the asset type tuple from the asset type
+	strings, for example:
+
+	('Fixed Income', 'Corporate', 'Investment Grade', 'Financial Institution')
+
+	=> (..., ('Fixed Income', 'Corporate'), (isInvestmentGrade, isFinancial))
+
+	Then fallsInAssetType() is the same as: the asset type matches the asset 
+	type strings and all attribute functions return True.
+	"""
+	attributes = tuple(reversed(list(takewhile(
+		lambda f: f != None
+	  , map(getAttributeFunction, reversed(assetTypeTuple))
+	))))
+
+	return ( assetTypeTuple
+		   , assetTypeTuple[:len(assetTypeTuple) - len(attributes)]
+		   , attributes
+		   )
+
+
+
+def compileAssetTypePlan(assetTypeTuples):
+	"""
+	[Iterable] assetTypeTuples (e.g., rows of the SFC template)
+		=> [Dictionary] plan, like
+
+		{ 'Rows': [Tuple] compiled rows, see compileAssetTypeRow()
+		, 'Candidates': [Dictionary] asset type -> [Tuple] rows whose asset
+						type strings match the asset type
+		}
+
+	The plan is used by routeAssetType(). The candidate rows are found the
+	first time an asset type is routed, so the template rows are scanned once
+	per asset type instead of once per position.
+	"""
+	return \
+	{ 'Rows': tuple(map(compileAssetTypeRow, dict.fromkeys(assetTypeTuples)))
+	, 'Candidates': {}
 	}
 
 
-	# [String] string => [Function] f if string matches one of the attributes
-	# else None
-	getAttributeFunction = compose(
-		partial(firstOf, lambda f: f != None)
-	  , lambda s: map( lambda key: attributeFunctions[key] if s.lower().startswith(key) else None
-	  		   		 , attributeFunctions.keys())
-	)
 
+def routeAssetType(plan, blpData, position):
+	"""
+	[Dictionary] plan, [Dictionary] blpData, [Dictionary] position
+		=> [Tuple] the first asset type tuple in the plan that the position
+			falls in, or None if there is no such asset type tuple
+	"""
+	assetType = getAssetType(blpData, position)
+	if not assetType in plan['Candidates']:
+		plan['Candidates'][assetType] = tuple(filter(
+			lambda row: assetTypeMatched(row[1], assetType)
+		  , plan['Rows']
+		))
+
+	row = firstOf( lambda row: all(map(lambda f: f(blpData, position), row[2]))
+				 , plan['Candidates'][assetType]
+				 )
+
+	return None if row == None else row[0]
+
+
+
+def compileCountryPlan(countryGroups):
+	"""
+	[Iterable] countryGroups (e.g., columns of the SFC template)
+		=> [Dictionary] plan, like
+
+		{ 'CountryGroups': [List] country groups
+		, 'Columns': [Array] country group code -> index of the country group
+						in 'CountryGroups', -1 if it is not there
+		}
+
+	The plan is used by routeCountryGroup(), so that routing a position to
+	a country group column is an array lookup instead of comparing strings.
+	A country group that appears more than once is kept once.
+	"""
+	countryGroups = list(dict.fromkeys(countryGroups))
+	columns = { countryGroup: i for i, countryGroup in enumerate(countryGroups) }
 
 	return \
-	True if len(assetTypeTuple) == 0 else \
-	fallsInAssetType(blpData, assetTypeTuple[:-1], position) and getAttributeFunction(assetTypeTuple[-1])(position) \
-	if getAttributeFunction(assetTypeTuple[-1]) != None else \
-	assetTypeMatched(assetTypeTuple, getAssetType(blpData, position))
+	{ 'CountryGroups': countryGroups
+	, 'Columns': array('i', map( lambda group: columns.get(group, -1)
+							   , getCountryGroupTable()['Groups']))
+	}
+
+
+
+"""
+	[Dictionary] plan, [Dictionary] blpData, [Dictionary] position
+		=> [Int] index of the position's country group in the plan, -1 if
+			the country group is not in the plan
+"""
+routeCountryGroup = lambda plan, blpData, position: \
+	plan['Columns'][getCountryGroupCode(blpData, position)]
+
+
+
+"""
+	[Exception] e => [String] reason of the classification failure
+"""
+toErrorReason = lambda e: '{0}: {1}'.format(type(e).__name__, e)
+
+
+
+def tryClassify(report, field, func, position):
+	"""
+	[Dictionary] exception report (None means raise), [String] field,
+	[Function] func(position), [Dictionary] position
+		=> result of func(position), or None if it fails and there is an
+			exception report
+
+	Collect errors mode for the report functions: the reason of a failure is
+	saved under the field of the position's security in the exception report
+	(see classifyPositions()), so the caller can skip the position and go on.
+	"""
+	if report == None:
+		return func(position)
+
+	try:
+		return func(position)
+	except Exception as e:
+		report.setdefault(getSecurityKey(position), {})[field] = toErrorReason(e)
+		return None
+
+
+
+def classifyPosition(blpData, position, collectErrors=False):
+	"""
+	[Dictionary] blpData, [Dictionary] position, [Bool] collectErrors
+		=> [Dictionary] classification of the position, like
+
+		{ 'AssetType': ('Equity', 'Listed Equities')
+		, 'CountryGroup': 'China - Hong Kong'
+		, 'Errors': {}
+		}
+
+	The country group is None if country does not apply to the position (see
+	countryNotApplicable()).
+
+	By default the first failure is raised. In collect errors mode, a field
+	that fails is None and the reason is saved under the field in 'Errors',
+	then classification goes on. A field that depends on a failed field is
+	None too, but without a reason of its own, e.g., no country group is
+	given to a position without an asset type.
+	"""
+	def classify(acc, field):
+		name, func = field
+		if any(map(lambda f: acc[f] == None, dependsOn.get(name, ()))):
+			acc[name] = None
+			return acc
+
+		try:
+			acc[name] = func(blpData, position)
+		except Exception as e:
+			if not collectErrors:
+				raise
+
+			acc[name] = None
+			acc['Errors'][name] = toErrorReason(e)
+
+		return acc
+
+
+	dependsOn = {'CountryGroup': ('AssetType', )}
+
+	return reduce( classify
+				 , [ ('AssetType', getAssetType)
+				   , ( 'CountryGroup'
+				   	 , lambda blpData, position: \
+				   	 	None if countryNotApplicable(blpData, position) else \
+				   	 	toCountryGroup(blpData, position)
+				   	 )
+				   ]
+				 , {'Errors': {}}
+				 )
+
+
+
+def classifyPositions(blpData, positions, collectErrors=False):
+	"""
+	[Dictionary] blpData, [Iterable] positions, [Bool] collectErrors
+		=> ( [List] classification of each position, see classifyPosition()
+		   , [Dictionary] exception report: security key (see getSecurityKey())
+		   		-> [Dictionary] field -> reason
+		   )
+
+	In collect errors mode, every position is classified and the failures of
+	all positions are put in the exception report, so one pass over a large
+	portfolio surfaces all the problems. Otherwise the first failure is raised
+	and the exception report is always empty.
+	"""
+	def accumulate(acc, el):
+		classifications, report = acc
+		classification = classifyPosition(blpData, el, collectErrors)
+		classifications.append(classification)
+		if len(classification['Errors']) > 0:
+			report.setdefault(getSecurityKey(el), {}).update(classification['Errors'])
+
+		return acc
+
+
+	return reduce(accumulate, positions, ([], {}))
 
 
 
@@ -592,4 +970,4 @@ def lognContinue(msg, x):
 
 def lognRaise(msg):
 	logger.error(msg)
-	raise ValueError
\ No newline at end of file
+	raise ValueError(msg)
\ No newline at end of file
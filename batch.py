@@ -0,0 +1,302 @@
+# coding=utf-8
+#
+# Generate asset allocation and liquidity reports for many portfolios and
+# dates in one process.
+#
+# Data shared by the portfolios on a date (BlpData, LQA data, FX, special
+# cases and the Bloomberg MAV export) are cached in data.py, so we run the
+# jobs date by date, then each input file is loaded once per date no matter
+# how many portfolios there are.
+#
+
+from risk_report.main import writeAssetAllocationCsv, writeLiquidityCsv
+from risk_report.sfc import readSfcTemplate
+from risk_report.data import genevaPortfolios, getBlpAccounts, getRatingScale \
+							, getGenevaInvestmentPositionFile \
+							, getCountryMapping, getAssetTypeSpecialCaseData, getFXStore
+from risk_report.utility import getCurrentDirectory
+from utils.utility import writeCsv
+from toolz.functoolz import compose
+from toolz.itertoolz import groupby as groupbyToolz, partition_all
+from functools import partial, lru_cache
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from os.path import join, exists
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+@lru_cache(maxsize=1)
+def getSfcTemplate():
+	"""
+	=> ( [List] country groups
+	   , [List] asset type tuples
+	   )
+
+	The SFC template is the same for all portfolios and dates, read it once.
+	"""
+	return \
+	compose(
+		lambda t: (t[0], list(t[1]))
+	  , readSfcTemplate
+	)(join(getCurrentDirectory(), 'SFC_Asset_Allocation_Template.xlsx'))
+
+
+
+"""
+	[String] report
+		=> [Function] f(portfolio, date, mode, reportingCurrency, collectErrors)
+			=> [String] output csv file name
+"""
+reportWriters = \
+{ 'allocation': lambda portfolio, date, mode, reportingCurrency, collectErrors: \
+		writeAssetAllocationCsv( portfolio, date, mode, reportingCurrency
+							   , *getSfcTemplate(), collectErrors)
+, 'liquidity': writeLiquidityCsv
+}
+
+
+
+def getAllAccounts(date, mode):
+	"""
+	[String] date (yyyymmdd), [String] mode
+		=> [List] all portfolios on the date: Geneva portfolios first, then
+			Bloomberg accounts.
+
+	A Geneva portfolio is run only if its investment positions file exists on
+	the date. Then its positions come from Geneva and its Bloomberg accounts
+	are skipped, the way data.getAllPositions() treats DIF (19437). Otherwise
+	its Bloomberg accounts are run.
+	"""
+	portfolios = list(filter( lambda portfolio: exists(getGenevaInvestmentPositionFile(portfolio, date, mode))
+							, genevaPortfolios))
+
+	isGenevaAccount = lambda account: \
+		any(map(lambda portfolio: account.startswith(portfolio), portfolios))
+
+
+	return \
+	list(chain( portfolios
+			  , filter( lambda account: not isGenevaAccount(account)
+			  		  , getBlpAccounts(date, mode))
+			  ))
+
+
+
+def getJobs(portfolios, dates, mode, reports):
+	"""
+	[List] portfolios (None means all accounts on each date),
+	[List] dates (yyyymmdd),
+	[String] mode,
+	[List] reports
+		=> [List] jobs, each job is a tuple (date, portfolio, report)
+
+	Jobs are ordered by date, so that the data of one date are loaded once
+	and used by all portfolios of that date.
+	"""
+	return [ (date, portfolio, report)
+			 for date in dates
+			 for portfolio in (getAllAccounts(date, mode) if portfolios == None else portfolios)
+			 for report in reports
+		   ]
+
+
+
+def runJob(mode, reportingCurrency, job, collectErrors=False):
+	"""
+	[String] mode, [String] reportingCurrency, [Tuple] job, [Bool] collectErrors
+		=> [Tuple] (date, portfolio, report, output file or error message)
+
+	A failed job is logged and reported, then the other jobs continue. In
+	collect errors mode, positions that fail do not fail the job, they are
+	written to the exception report of the job, see main.writeExceptionReport().
+	"""
+	date, portfolio, report = job
+	logger.info('runJob(): {0}'.format(job))
+
+	try:
+		return ( date, portfolio, report
+			   , reportWriters[report](portfolio, date, mode, reportingCurrency, collectErrors))
+	except Exception as e:
+		logger.exception('runJob(): {0} failed'.format(job))
+		return (date, portfolio, report, 'error: {0}'.format(repr(e)))
+
+
+
+def runBatch( portfolios, dates, mode, reportingCurrency='USD'
+			, reports=tuple(reportWriters.keys()), collectErrors=False):
+	"""
+	[List] portfolios (None means all accounts on each date),
+	[List] dates (yyyymmdd),
+	[String] mode,
+	[String] reportingCurrency,
+	[List] reports,
+	[Bool] collectErrors
+		=> [List] results, see runJob()
+
+	Side effect: create a csv file for each report of each portfolio on each
+	date.
+	"""
+	return list(map( partial(runJob, mode, reportingCurrency, collectErrors=collectErrors)
+				   , getJobs(portfolios, dates, mode, reports)))
+
+
+
+def runJobs(mode, reportingCurrency, collectErrors, jobs):
+	"""
+	[String] mode, [String] reportingCurrency, [Bool] collectErrors, [List] jobs
+		=> [List] results, see runJob()
+	"""
+	return list(map(partial(runJob, mode, reportingCurrency, collectErrors=collectErrors), jobs))
+
+
+
+def warmUpWorker():
+	"""
+	Load the data that do not depend on date, so that each worker process
+	reads them once when it starts, instead of in the first job.
+	"""
+	getRatingScale()
+	getCountryMapping()
+	getAssetTypeSpecialCaseData()
+	getFXStore()
+	getSfcTemplate()
+
+
+
+def getChunks(jobs, workers):
+	"""
+	[List] jobs, [Int] workers => [List] chunks, each chunk is a list of jobs
+
+	Jobs of the same date are kept together in a chunk where possible, so that
+	a worker loads the data of a date once for all the jobs in the chunk. The
+	jobs of a date are split into at most as many chunks as workers, so that 
+	a single date is still run in parallel.
+	"""
+	splitJobs = lambda jobs: \
+		partition_all(ceil(len(jobs) / workers), jobs)
+
+
+	return \
+	compose(
+		list
+	  , partial(map, list)
+	  , chain.from_iterable
+	  , partial(map, splitJobs)
+	  , lambda d: d.values()
+	  , partial(groupbyToolz, lambda job: job[0])
+	)(jobs)
+
+
+
+def runBatchParallel( portfolios, dates, mode, reportingCurrency='USD'
+					, reports=tuple(reportWriters.keys()), workers=4, collectErrors=False):
+	"""
+	[List] portfolios (None means all accounts on each date),
+	[List] dates (yyyymmdd),
+	[String] mode,
+	[String] reportingCurrency,
+	[List] reports,
+	[Int] workers,
+	[Bool] collectErrors
+		=> [List] results, see runJob()
+
+	The same as runBatch(), except that the jobs are run in a pool of worker
+	processes. The results are in the same order as runBatch(), no matter
+	which job finishes first.
+	"""
+	with ProcessPoolExecutor(max_workers=workers, initializer=warmUpWorker) as executor:
+		return \
+		compose(
+			list
+		  , chain.from_iterable
+		  , partial(executor.map, partial(runJobs, mode, reportingCurrency, collectErrors))
+		  , lambda jobs: getChunks(jobs, workers)
+		)(getJobs(portfolios, dates, mode, reports))
+
+
+
+def writeBatchSummary(file, results):
+	"""
+	[String] output file name, [Iterable] results
+		=> [String] output file name
+	"""
+	return writeCsv(file, chain([('Date', 'Portfolio', 'Report', 'Output')], results))
+
+
+
+
+if __name__ == '__main__':
+	import logging.config
+	logging.config.fileConfig('logging.config', disable_existing_loggers=False)
+
+	"""
+		Generate reports for a list of portfolios on a list of dates, say
+		19437 and 60001 on 2021-03-31 and 2021-06-30, do
+
+			$python batch.py 19437 60001 --dates 20210331 20210630
+
+		To generate reports for all accounts on each date, do
+
+			$python batch.py --all-accounts --dates 20210630
+
+		To generate only the liquidity reports, do
+
+			$python batch.py --all-accounts --dates 20210630 --report liquidity
+
+		To regenerate reports of many dates using 4 worker processes, do
+
+			$python batch.py 19437 --dates 20201231 20210331 20210630 --workers 4
+
+		To go on when positions of a portfolio cannot be classified or have
+		no liquidity category, and write them to an exception report for each
+		report, do
+
+			$python batch.py --all-accounts --dates 20210630 --collect-errors
+	"""
+
+	import argparse
+	parser = argparse.ArgumentParser(description='Generate reports for many portfolios and dates.')
+	parser.add_argument( 'portfolios', metavar='portfolio', type=str, nargs='*'
+					   , help='portfolios to run')
+	parser.add_argument( '--dates', metavar='date', type=str, nargs='+', required=True
+					   , help='dates of the positions (yyyymmdd)')
+	parser.add_argument( '--all-accounts', type=str, nargs='?', const=True, default=False
+					   , help='run all accounts on each date')
+	parser.add_argument( '--report', type=str, nargs='+', choices=list(reportWriters.keys())
+					   , default=list(reportWriters.keys()), help='reports to generate')
+	parser.add_argument( '--test', type=str, nargs='?', const=True, default=False
+					   , help='use test mode datastore')
+	parser.add_argument( '--workers', type=int, default=1
+					   , help='number of worker processes (default 1, no worker process)')
+	parser.add_argument( '--stats', type=str, default=None
+					   , help='save timing and cache statistics to a json file (no worker process only)')
+	parser.add_argument( '--collect-errors', action='store_true'
+					   , help='write failed positions to an exception report instead of failing the job')
+	args = parser.parse_args()
+
+	if args.stats:
+		import risk_report.instrument as instrument
+		instrument.enable()
+
+	if not args.all_accounts and len(args.portfolios) == 0:
+		parser.error('give a list of portfolios or use --all-accounts')
+
+	mode = 'test' if args.test else 'production'
+
+	compose(
+		print
+	  , partial(writeBatchSummary, 'batch_' + args.dates[0] + '_' + args.dates[-1] + '.csv')
+	  , lambda portfolios: \
+	  		runBatch(portfolios, args.dates, mode, 'USD', args.report, args.collect_errors) \
+	  		if args.workers < 2 else \
+	  		runBatchParallel( portfolios, args.dates, mode, 'USD', args.report, args.workers
+	  						, args.collect_errors)
+	)(None if args.all_accounts else args.portfolios)
+
+
+	if args.stats:
+		import risk_report.data
+		instrument.dumpStats(args.stats, risk_report.data)
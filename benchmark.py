@@ -0,0 +1,491 @@
+# coding=utf-8
+#
+# Benchmark the report pipeline on synthetic portfolios of different sizes.
+#
+# The synthetic inputs (Geneva investment positions, Bloomberg MAV export,
+# BlpData, LQA response and liquidity special cases) are made from the
+# sample files of a template date in test mode. Each synthetic security is
+# a copy of a sample security with a new id, so it is classified, rated and
+# measured for liquidity the same way as the sample one, while the number of
+# distinct securities grows with the size.
+#
+# The Excel inputs are saved as snapshots of empty files (see snapshot.py),
+# so no Excel writer is needed and the pipeline reads them the same way it
+# reads a real file the second time.
+#
+from risk_report.utility import getInputDirectory, setInputDirectory, getCurrentDirectory
+from risk_report.snapshot import fileToLinesSnapshot, getSnapshotFile, saveSnapshot
+from risk_report.geneva import getGenevaIdnType
+from risk_report.blp import getBlpIdnType, isBlpPrivateSecurity
+from risk_report.data import getPortfolioPositions, getBlpData, getAssetTypeSpecialCaseData \
+							, getLiquiditySpecialCaseData, getLiquidityOverrideOnDate
+from risk_report.asset import getAssetType
+from risk_report.main import writeAssetAllocationCsv, getLiquidityDistribution \
+							, getAssetTypeAllocation, getCountryGroupAllocation
+from risk_report.lqa import createLqaPositions, createLqaAggregates
+from risk_report.batch import getSfcTemplate
+from risk_report.instrument import clearCaches
+import risk_report.data
+from utils.utility import writeCsv
+from toolz.functoolz import compose
+from toolz.itertoolz import groupby as groupbyToolz
+from functools import partial
+from itertools import chain, cycle, islice, dropwhile, takewhile
+from time import perf_counter
+from os import makedirs, chdir, getcwd
+from os.path import join
+import tracemalloc
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+""" The sample files of this date (test mode) are used as templates """
+templateDate = '20200529'
+
+
+
+""" [Iterable] x => [Int] number of items in x """
+count = lambda x: sum(1 for _ in x)
+
+
+
+def getTemplateLines(file):
+	"""
+	[String] file name in the test mode input directory (Excel)
+		=> [List] lines of the file
+	"""
+	return list(fileToLinesSnapshot(join(getInputDirectory('test'), file)))
+
+
+
+def getFixedIds(date):
+	"""
+	[String] date (yyyymmdd) => [Set] ids that are not replaced
+
+	Securities with special case handling are looked up by their ids, so
+	their copies keep the original ids.
+	"""
+	return set(chain( getAssetTypeSpecialCaseData().keys()
+					, getLiquiditySpecialCaseData(date, 'test').keys()
+					, getLiquidityOverrideOnDate(date).keys()
+					))
+
+
+
+def toSyntheticId(fixedIds, i, idnType):
+	"""
+	[Set] fixed ids, [Int] i, [Tuple] (id, idType) of the template security
+		=> [String] id of the i-th synthetic security
+
+	An ISIN is replaced by a 12 character id, an equity ticker like
+	'1299 HK Equity' by 'SY<i> HK Equity', others (cash, fx forward etc.)
+	keep their ids.
+	"""
+	securityId, idType = idnType
+	return \
+	securityId if securityId in fixedIds else \
+	'SY' + str(i).zfill(10) if idType == 'ISIN' else \
+	' '.join(['SY' + str(i)] + securityId.split()[1:]) if securityId.endswith(' Equity') else \
+	securityId
+
+
+
+""" [String] id => [String] ticker without the ' Equity' suffix """
+removeEquitySuffix = lambda securityId: \
+	securityId[:-len(' Equity')] if securityId.endswith(' Equity') else securityId
+
+
+
+def replaceFields(header, line, fields):
+	"""
+	[List] header, [List] line, [Dictionary] field -> new value
+		=> [List] a copy of the line with the fields replaced
+	"""
+	return [fields.get(h, x) for h, x in zip(header, line)] + line[len(header):]
+
+
+
+def generateGenevaLines(fixedIds, offset, n, lines):
+	"""
+	[Set] fixed ids, [Int] offset (number of the first synthetic security),
+	[Int] n, [List] lines of the template Geneva investment positions report
+		=> ( [List] lines of the synthetic report with n investment positions
+		   , [List] (synthetic id, template id) of each position
+		   )
+
+	Lines other than investment positions (cash receivables, payables and the
+	report parameters) are kept as they are.
+	"""
+	isInvestment = lambda line: len(line) > 0 and line[0] == 'Investments'
+	header = next(filter(lambda line: 'InvestID' in line, lines))
+	templates = [ (line, getGenevaIdnType(dict(zip(header, line))))
+				  for line in filter(isInvestment, lines)]
+
+	ids, positionLines = [], []
+	for i, (line, idnType) in enumerate(islice(cycle(templates), n)):
+		securityId = toSyntheticId(fixedIds, offset + i, idnType)
+		ids.append((securityId, idnType[0]))
+		positionLines.append(replaceFields( header, line
+										  , {'InvestID': removeEquitySuffix(securityId)} \
+												if securityId != idnType[0] else {}))
+
+	return \
+	( list(chain( takewhile(lambda line: not isInvestment(line), lines)
+				, positionLines
+				, dropwhile(isInvestment, dropwhile(lambda line: not isInvestment(line), lines))
+				))
+	, ids
+	)
+
+
+
+def generateMavLines(fixedIds, offset, n, lines):
+	"""
+	[Set] fixed ids, [Int] offset (number of the first synthetic security),
+	[Int] n, [List] lines of the template Bloomberg MAV export
+		=> ( [List] lines of the synthetic export with n positions
+		   , [List] (synthetic id, template id) of each position
+		   )
+
+	Positions of DIF (19437) are skipped because they come from Geneva, the
+	summary lines (whose account code is empty) are dropped.
+	"""
+	headerLines = list(takewhile(lambda line: len(line) == 0 or line[0] != 'Name', lines))
+	header = lines[len(headerLines)]
+	floatToString = lambda x: str(int(x)) if isinstance(x, float) else x
+	isTemplate = lambda position: \
+		not position['Account Code'] in ['', None] \
+		and not floatToString(position['Account Code']).startswith('19437')
+
+	templates = [ (line, getBlpIdnType(position), isBlpPrivateSecurity(position))
+				  for line, position in map(lambda line: (line, dict(zip(header, line))), lines[len(headerLines) + 1:])
+				  if isTemplate(position)]
+
+	toFields = lambda securityId: \
+		{'Name': removeEquitySuffix(securityId)} if securityId.endswith(' Equity') else \
+		{'ISIN': securityId}
+
+	ids, positionLines = [], []
+	for i, (line, idnType, isPrivate) in enumerate(islice(cycle(templates), n)):
+		# a private security is told by its name, so it keeps the name
+		securityId = idnType[0] if isPrivate else toSyntheticId(fixedIds, offset + i, idnType)
+		ids.append((securityId, idnType[0]))
+		positionLines.append(replaceFields( header, line
+										  , toFields(securityId) if securityId != idnType[0] else {}))
+
+	return (headerLines + [header] + positionLines, ids)
+
+
+
+def generateBlpDataLines(ids, lines):
+	"""
+	[List] (synthetic id, template id), [List] lines of the template BlpData
+		=> [List] lines of the synthetic BlpData, one row for each synthetic
+			security whose template security has BlpData.
+	"""
+	header = lines[0]
+	templates = { line[header.index('ID')]: line for line in lines[1:] }
+
+	return \
+	list(chain( lines
+			  , ( replaceFields(header, templates[templateId], {'ID': securityId})
+			  	  for securityId, templateId in ids
+			  	  if securityId != templateId and templateId in templates
+			  	)
+			  ))
+
+
+
+def generateLqaLines(ids, lines, separator='|'):
+	"""
+	[List] (synthetic id, template id), [List] lines of the template LQA
+		response (.bbg) => [List] lines of the synthetic LQA response
+
+	A security id in the LQA response can be like "XS1234567890 PerfShs",
+	where only the first part is the ISIN, see data.readLqaColumns().
+	"""
+	toTemplateId = lambda securityId: \
+		securityId.split()[0] if len(securityId.split()) > 0 and len(securityId.split()[0]) == 12 else \
+		securityId
+
+	headerLines = list(takewhile(lambda line: not line.startswith('START-OF-DATA'), lines))
+	dataLines = list(takewhile( lambda line: not line.startswith('END-OF-DATA')
+							  , lines[len(headerLines) + 2:]))
+	templates = { toTemplateId(line.split(separator)[0].replace('"', '')): line \
+					for line in dataLines if line != '' }
+
+	return \
+	list(chain( lines[:len(headerLines) + 2]
+			  , dataLines
+			  , ( separator.join([securityId] + templates[templateId].split(separator)[1:])
+				  for securityId, templateId in ids
+				  if securityId != templateId and templateId in templates
+				)
+			  , lines[len(headerLines) + 2 + len(dataLines):]
+			  ))
+
+
+
+def writeLinesAsExcel(file, lines):
+	"""
+	[String] file (Excel), [List] lines => [String] file
+
+	Side effect: create an empty file and save the lines as its snapshot, so
+	that reading the file gives the lines.
+	"""
+	open(file, 'w').close()
+	saveSnapshot(getSnapshotFile(file), lines)
+	return file
+
+
+
+def writeTextLines(file, lines):
+	"""
+	[String] file, [List] lines => [String] file
+	"""
+	with open(file, 'w') as f:
+		f.write('\n'.join(lines) + '\n')
+
+	return file
+
+
+
+def generateInputs(directory, size, date=templateDate):
+	"""
+	[String] directory, [Int] size (number of positions), [String] date
+		=> [String] directory
+
+	Side effect: create the synthetic input files of the date under the
+	directory. Half of the positions are DIF (19437) positions in Geneva,
+	the other half Bloomberg positions of other accounts.
+	"""
+	makedirs(directory, exist_ok=True)
+	fixedIds = getFixedIds(date)
+	genevaLines, genevaIds = generateGenevaLines(
+		fixedIds, 0, size // 2, getTemplateLines('19437_Investment_Positions_' + date + '.xlsx'))
+	mavLines, mavIds = generateMavLines(
+		fixedIds, size // 2, size - size // 2, getTemplateLines('risk_m2_mav_' + date + '.xlsx'))
+
+	with open(join(getInputDirectory('test'), 'LqaData_' + date + '.bbg')) as f:
+		lqaLines = f.read().splitlines()
+
+	writeLinesAsExcel(join(directory, '19437_Investment_Positions_' + date + '.xlsx'), genevaLines)
+	writeLinesAsExcel(join(directory, 'risk_m2_mav_' + date + '.xlsx'), mavLines)
+	writeLinesAsExcel( join(directory, 'BlpData_' + date + '.xlsx')
+					 , generateBlpDataLines(genevaIds + mavIds, getTemplateLines('BlpData_' + date + '.xlsx')))
+	writeLinesAsExcel( join(directory, 'Liquidity_SpecialCase_' + date + '.xlsx')
+					 , getTemplateLines('Liquidity_SpecialCase_' + date + '.xlsx'))
+	writeTextLines( join(directory, 'LqaData_' + date + '.bbg')
+				  , generateLqaLines(genevaIds + mavIds, lqaLines))
+
+	logger.info('generateInputs(): {0} positions under {1}'.format(size, directory))
+	return directory
+
+
+
+"""
+	[String] date, [String] mode
+		=> [List] stages, each stage is a tuple (name, prepare, run), where
+
+		prepare: [Function] f() => inputs of the stage (not timed)
+		run: [Function] f(inputs) => [Int] number of positions processed
+
+	The allocation stages count the positions put into a bucket, consuming
+	each bucket to the end. The createLqaAggregates stage is the part of
+	createLqaPositions that reads and aggregates all the positions.
+
+	Each stage starts with empty caches, so it includes reading the inputs it
+	needs, the same as a report run.
+"""
+getStages = lambda date, mode: \
+[ ( 'getPortfolioPositions'
+  , lambda: None
+  , lambda _: count(getPortfolioPositions('all', date, mode))
+  )
+, ( 'getAssetType'
+  , lambda: (getBlpData(date, mode), list(getPortfolioPositions('all', date, mode)))
+  , lambda t: count(map(partial(getAssetType, t[0]), t[1]))
+  )
+, ( 'writeAssetAllocationCsv'
+  , lambda: count(getPortfolioPositions('all', date, mode))
+  , lambda n: writeAssetAllocationCsv('all', date, mode, 'USD', *getSfcTemplate()) and n
+  )
+, ( 'getLiquidityDistribution'
+  , lambda: count(getPortfolioPositions('all', date, mode))
+  , lambda n: count(getLiquidityDistribution('all', date, mode, 'USD')) and n
+  )
+, ( 'createLqaPositions'
+  , lambda: None
+  , lambda _: sum(map(count, createLqaPositions('all', date, mode)))
+  )
+, ( 'getAssetTypeAllocation'
+  , lambda: (getBlpData(date, mode), list(getPortfolioPositions('all', date, mode)))
+  , lambda t: count(chain.from_iterable(
+  		getAssetTypeAllocation(date, t[0], getSfcTemplate()[1], t[1]).values()))
+  )
+, ( 'getCountryGroupAllocation'
+  , lambda: (getBlpData(date, mode), list(getPortfolioPositions('all', date, mode)))
+  , lambda t: count(chain.from_iterable(
+  		getCountryGroupAllocation(date, t[0], getSfcTemplate()[0], t[1]).values()))
+  )
+, ( 'createLqaAggregates'
+  , lambda: count(getPortfolioPositions('all', date, mode))
+  , lambda n: createLqaAggregates('all', date, mode) and n
+  )
+]
+
+
+
+def runStage(prepare, run, traceMemory=False):
+	"""
+	[Function] prepare, [Function] run, [Bool] traceMemory
+		=> ( [Int] number of positions
+		   , [Float] seconds
+		   , [Int] peak memory allocated by the run (bytes), 0 if not traced
+		   )
+	"""
+	clearCaches(risk_report.data)
+	inputs = prepare()
+	clearCaches(risk_report.data)
+
+	if traceMemory:
+		tracemalloc.start()
+
+	start = perf_counter()
+	n = run(inputs)
+	seconds = perf_counter() - start
+	peak = tracemalloc.get_traced_memory()[1] if traceMemory else 0
+
+	if traceMemory:
+		tracemalloc.stop()
+
+	return (n, seconds, peak)
+
+
+
+def benchmark(directory, size, date=templateDate):
+	"""
+	[String] directory, [Int] size, [String] date
+		=> [List] rows of (size, stage, positions, seconds, positions per
+			second, peak memory in MB)
+
+	Each stage is run twice: timed, then traced for memory, because tracing
+	memory allocations slows down the run.
+	"""
+	mode = 'benchmark_' + str(size)
+	setInputDirectory(mode, generateInputs(join(directory, str(size)), size, date))
+
+	def toRow(stage, prepare, run):
+		n, seconds, _ = runStage(prepare, run)
+		_, _, peak = runStage(prepare, run, True)
+		logger.info('benchmark(): {0} {1} {2:.3f}s'.format(size, stage, seconds))
+		return (size, stage, n, seconds, n / seconds if seconds > 0 else 0, peak / 2**20)
+
+
+	currentDirectory = getcwd()
+	chdir(join(directory, str(size)))	# where the reports are written
+	try:
+		return [toRow(*stage) for stage in getStages(date, mode)]
+	finally:
+		chdir(currentDirectory)
+
+
+
+def getScaling(rows):
+	"""
+	[List] rows (see benchmark())
+		=> [List] rows of (stage, size, microseconds per position, ratio to
+			the smallest size)
+
+	A stage scales linearly if its time per position stays about the same as
+	the size grows, i.e., the ratio stays close to 1.
+	"""
+	perPosition = lambda row: row[3] / row[2] * 1e6 if row[2] > 0 else 0
+
+	toRows = lambda stageRows: \
+		map( lambda row: ( row[1], row[0], perPosition(row)
+						 , perPosition(row) / perPosition(stageRows[0]) \
+						 	if perPosition(stageRows[0]) > 0 else 0
+						 )
+		   , stageRows)
+
+
+	return \
+	compose(
+		list
+	  , chain.from_iterable
+	  , partial(map, toRows)
+	  , partial(map, partial(sorted, key=lambda row: row[0]))
+	  , lambda d: d.values()
+	  , partial(groupbyToolz, lambda row: row[1])
+	)(rows)
+
+
+
+def showResults(rows):
+	"""
+	[List] rows => [List] rows
+
+	Side effect: print the rows as a table.
+	"""
+	print('{0:>9} {1:<26} {2:>9} {3:>10} {4:>14} {5:>10}'.format(
+		'Size', 'Stage', 'Positions', 'Seconds', 'Positions/s', 'Peak MB'))
+	for row in rows:
+		print('{0:>9} {1:<26} {2:>9} {3:>10.3f} {4:>14.0f} {5:>10.1f}'.format(*row))
+
+	print('\n{0:<26} {1:>9} {2:>12} {3:>8}'.format('Stage', 'Size', 'us/position', 'Ratio'))
+	for row in getScaling(rows):
+		print('{0:<26} {1:>9} {2:>12.2f} {3:>8.2f}'.format(*row))
+
+	return rows
+
+
+
+
+if __name__ == '__main__':
+	import logging.config
+	logging.config.fileConfig('logging.config', disable_existing_loggers=False)
+
+	"""
+		Run the benchmark on synthetic portfolios of 1k, 10k and 100k
+		positions, do
+
+			$python benchmark.py
+
+		To give the sizes, do
+
+			$python benchmark.py --sizes 1000 10000 100000 1000000
+
+		To check that the stages scale linearly up to 1M positions, do
+
+			$python benchmark.py --scaling
+
+		The time per position of each stage is printed for each size, with
+		its ratio to the smallest size.
+
+		Results are printed and saved to benchmark.csv. The sample files of
+		the template date must be in the test mode input directory.
+	"""
+
+	import argparse
+	parser = argparse.ArgumentParser(description='Benchmark the reports on synthetic portfolios.')
+	parser.add_argument( '--sizes', metavar='size', type=int, nargs='+'
+					   , default=[1000, 10000, 100000], help='number of positions')
+	parser.add_argument( '--directory', type=str, default=join(getCurrentDirectory(), 'benchmark_data')
+					   , help='where the synthetic inputs are generated')
+	parser.add_argument( '--output', type=str, default='benchmark.csv'
+					   , help='output csv file')
+	parser.add_argument( '--scaling', type=str, nargs='?', const=True, default=False
+					   , help='run sizes from 1k to 1M positions')
+	args = parser.parse_args()
+
+	compose(
+		print
+	  , partial(writeCsv, args.output)
+	  , lambda rows: chain([('Size', 'Stage', 'Positions', 'Seconds', 'Positions per second', 'Peak memory (MB)')], rows)
+	  , showResults
+	  , list
+	  , chain.from_iterable
+	  , partial(map, partial(benchmark, args.directory))
+	)([1000, 10000, 100000, 1000000] if args.scaling else args.sizes)
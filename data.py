@@ -3,37 +3,69 @@
 # Functions related to data retrieving are grouped here.
 # 
 from risk_report.utility import getInputDirectory, getDataDirectory
-from risk_report.blp import getBlpPortfolioId, getBlpPositionDate, getBlpMarketValue \
-							, getBlpBookCurrency, getBlpPortfolioId, getBlpIdnType \
-							, getBlpQuantity, isBlpPrivateSecurity, isBlpRepo \
-							, isBlpMoneyMarket, isBlpCash, isBlpFxForward, isBlpFund
-from risk_report.geneva import isGenevaPosition, getGenevaPortfolioId, getGenevaPositionDate \
-							, getGenevaMarketValue, getGenevaBookCurrency, getGenevaPortfolioId \
-							, getGenevaIdnType, getGenevaAssetType, isGenevaFund, isGenevaFxForward, isGenevaCash \
-							, isGenevaRepo, isGenevaMoneyMarket, isGenevaPrivateSecurity \
-							, getGenevaQuantity
+from risk_report.blp import getBlpPortfolioId
+from risk_report.geneva import isGenevaPosition
 from clamc_datafeed.feeder import getPositions
-from steven_utils.excel import getRawPositionsFromLines, fileToLines, getRawPositionsFromFile \
-							, fromExcelOrdinal
+from risk_report.position import Position, toPosition, accessorTables
+from risk_report.snapshot import fileToLinesSnapshot
+from risk_report.instrument import timed
+from steven_utils.excel import getRawPositionsFromLines, fromExcelOrdinal
 from steven_utils.iter import pop, firstOf
 from steven_utils.utility import mergeDict
 from toolz.functoolz import compose
+from toolz.itertoolz import groupby as groupbyToolz
 from toolz.dicttoolz import valmap
-from functools import partial, lru_cache
-from itertools import filterfalse, takewhile, dropwhile, chain
+from functools import partial, lru_cache, reduce
+from itertools import filterfalse, takewhile, dropwhile, chain, zip_longest
+from collections.abc import Mapping
+from array import array
+from math import nan, isnan
 from datetime import datetime
-from os.path import join
+from os.path import join, exists
 import logging
 logger = logging.getLogger(__name__)
 
 
 
+"""
+	[String] file (Excel) => [Iterator] raw positions
+
+	Read through the snapshot, so that each version of an Excel file is only
+	decoded once, see snapshot.py.
+"""
+getRawPositionsFromFile = compose(getRawPositionsFromLines, fileToLinesSnapshot)
+
+
+
 getCountryMapping = lambda: loadCountryGroupMappingFromFile('SFC_Country.xlsx')
 
 
 getRatingScoreMapping = lambda: loadRatingScoreMappingFromFile('RatingScore.xlsx')
 
 
+
+@lru_cache(maxsize=1)
+def getCountryGroupTable():
+	"""
+	=> [Dictionary] the country mapping compiled into integer codes, like
+
+		{ 'Codes': [Dictionary] country code -> [Int] country group code
+		, 'Groups': [List] country group of each country group code
+		}
+
+	Country groups are coded 0, 1, 2 ..., so that a table over country groups
+	is an array indexed by the code, see asset.compileCountryPlan().
+	"""
+	mapping = getCountryMapping()
+	groups = sorted(set(mapping.values()))
+	groupCodes = { group: code for code, group in enumerate(groups) }
+
+	return \
+	{ 'Codes': valmap(lambda group: groupCodes[group], mapping)
+	, 'Groups': groups
+	}
+
+
 getAssetTypeSpecialCaseData = lambda: loadAssetTypeSpecialCaseFromFile('AssetType_SpecialCase.xlsx')
 
 
@@ -43,22 +75,33 @@ getLiquiditySpecialCaseData = lambda date, mode: \
 
 
 
+""" Portfolios whose positions come from Geneva, others from Bloomberg """
+genevaPortfolios = ['19437', '60001']
+
+
+
 """
 	[String] portfolio, [String] date (yyyymmdd), [String] mode
 		=> [Iterator] positions of the portfolio 
 """
-getPortfolioPositions = lambda portfolio, date, mode='production': \
-	getAllPositions(date, mode) if portfolio.lower() == 'all' else \
-	getGenevaPositions(portfolio, date, mode) if portfolio in ['19437', '60001'] else \
-	getBlpPositions(portfolio, date, mode)
+getPortfolioPositions = timed('getPortfolioPositions')(
+	lambda portfolio, date, mode='production': \
+		getAllPositions(date, mode) if portfolio.lower() == 'all' else \
+		getGenevaPositions(portfolio, date, mode) if portfolio in genevaPortfolios else \
+		getBlpPositions(portfolio, date, mode)
+)
 
 
 
+@timed('getBlpData')
 @lru_cache(maxsize=3)
 def getBlpData(date, mode='production'):
 	"""
 	[String] date (yyyymmdd), [String] mode
 		=> [Dictionary] meta data of the positions 
+
+	Each row also has a 'RatingRecord' field, the rating scores of the
+	security computed when the file is loaded, see toRatingRecords().
 	"""
 	getBlpDataFile = lambda date, mode: \
 		join(getInputDirectory(mode), 'BlpData_' + date + '.xlsx')
@@ -67,50 +110,194 @@ def getBlpData(date, mode='production'):
 	return \
 	compose(
 		dict
-	  , partial(map, lambda p: (p['ID'], p))
+	  , lambda rows: map( lambda t: (t[0]['ID'], mergeDict(t[0], {'RatingRecord': t[1]}))
+	  					, zip(rows, toRatingRecords(rows)))
+	  , list
 	  , getRawPositionsFromFile
 	  , getBlpDataFile
 	)(date, mode)
 
 
 
-@lru_cache(maxsize=3)
-def getLqaData(date, mode='production', separator='|'):
+""" (rating agency, BlpData field) of the rating agencies """
+ratingFields = (('S&P', 'RTG_SP'), ('Moody\'s', 'RTG_MOODY'), ('Fitch', 'RTG_FITCH'))
+
+
+
+class RatingRecord:
 	"""
-	[String] date (yyyymmdd), [String] mode
-		=> [Dictionary] id -> lqa data (dictionary)
+	Rating scores of a security.
+
+	codes: (S&P, Moody's, Fitch) rating codes, see getRatingScale().
+	scores: (S&P, Moody's, Fitch) rating scores, a score is 0 if the agency
+		gives no rating, None if the rating is not in the rating score
+		mapping.
+	average: the average of the scores (see averageRatingScore()), None if
+		no agency gives a rating or a rating is not in the mapping.
 	"""
-	def fileToLines(file):
-		with open(file, 'r') as lqaFile:
-			for line in lqaFile:
-				yield line.strip()
+	__slots__ = ('codes', 'scores', 'average')
 
+	def __init__(self, codes, scores, average):
+		self.codes = codes
+		self.scores = scores
+		self.average = average
 
-	getLqaDataFile = lambda date, mode: \
-		join(getInputDirectory(mode), 'LqaData_' + date + '.bbg')
+	def __repr__(self):
+		return 'RatingRecord({0}, {1}, {2})'.format(self.codes, self.scores, self.average)
 
 
-	toPosition = lambda headers, line: dict(zip(headers, line))
 
-	# Take the lines between 'START-OF-DATA' and 'END-OF-DATA'
-	takeInBetween = compose(
-		lambda t: takewhile(lambda L: L[0] != 'END-OF-DATA', t[1])
-	  , lambda lines: (pop(lines), lines)
-	  , partial(dropwhile, lambda L: len(L) == 0 or L[0] != 'START-OF-DATA')
-	)
+@lru_cache(maxsize=1)
+def getRatingScale():
+	"""
+	=> [Dictionary] the rating score mapping compiled into integer codes, like
+
+		{ 'Codes': [Dictionary] rating string -> [Int] rating code
+		, 'Scores': [Tuple] for each agency in ratingFields, an array of
+						scores indexed by rating code
+		}
+
+	Code 0 means no rating ('#N/A ...'), its score is 0. A rating string has
+	the same code for all agencies, the score is NaN if the agency does not
+	use that rating.
+	"""
+	mapping = getRatingScoreMapping()
+	ratings = sorted(set(map(lambda key: key[1], mapping)))
+
+	return \
+	{ 'Codes': { rating: code for code, rating in enumerate(ratings, 1) }
+	, 'Scores': tuple(map( lambda t: array('d', chain([0], map( lambda rating: mapping.get((t[0], rating), nan)
+															  , ratings)))
+						 , ratingFields))
+	}
+
+
+
+"""
+	[Dictionary] rating scale, [String] rating
+		=> [Int] rating code, 0 if no rating, -1 if the rating is not in the
+			rating scale
+"""
+encodeRating = lambda scale, rating: \
+	0 if str(rating).startswith('#N/A') else scale['Codes'].get(rating, -1)
+
+
+
+"""
+	[Array] scores of an agency (see getRatingScale()), [Int] rating code
+		=> [Float] rating score, None if the agency does not use the rating
+"""
+decodeRatingScore = lambda scores, code: \
+	None if code < 0 or isnan(scores[code]) else scores[code]
+
+
+
+"""
+	[Tuple] scores => [Float] average score, None if no score
+
+	Ratings of 0 (no rating) are ignored. With one rating, the score is that
+	rating; with two, the lower one; with three, the middle one.
+"""
+averageRatingScore = compose(
+	lambda scores: \
+		None if len(scores) == 0 else \
+		scores[0] if len(scores) == 1 else \
+		min(scores) if len(scores) == 2 else \
+		sorted(scores)[1]
+  , lambda scores: list(filterfalse(lambda x: x == 0, scores))
+)
+
+
+
+def toRatingRecords(rows):
+	"""
+	[List] BlpData rows => [List] rating record of each row
+
+	Each rating column is encoded into an array of rating codes once for all
+	rows, then decoded into scores by array index, and the average is
+	computed from the scores of each row.
+	"""
+	scale = getRatingScale()
+
+	codeColumns = list(map( lambda field: array('i', map( lambda row: encodeRating(scale, row.get(field, '#N/A'))
+														, rows))
+						  , map(lambda t: t[1], ratingFields)))
+
+	scoreColumns = list(map( lambda t: list(map(partial(decodeRatingScore, t[0]), t[1]))
+						   , zip(scale['Scores'], codeColumns)))
+
+
+	return \
+	list(map( lambda t: RatingRecord( t[0], t[1]
+									, None if None in t[1] else averageRatingScore(t[1]))
+			, zip(zip(*codeColumns), zip(*scoreColumns))))
+
+
+
+"""
+	Columns of the LQA response that are numbers. They are decoded into arrays
+	of floats. A value that is not a number, like 'N.A.', is saved as NaN in
+	the array and its original string is kept in the column's exceptions.
+"""
+lqaNumericColumns = frozenset([ 'ERROR CODE', 'NUM FLDS', 'LQA_MARKET_PRICE_UNC_PRICE'
+							  , 'LQA_TGT_LIQUIDATION_VOLUME', 'LQA_TGT_LIQUIDATION_HORIZON'
+							  , 'LQA_LIQUIDATION_COST', 'LQA_TOTAL_LIQUIDATION_COST'
+							  , 'LQA_TGT_LIQUIDATION_COST', 'LQA_LIQUIDATION_HORIZON'
+							  , 'LQA_TIME_TO_CASH'
+							  ])
+
+
+
+getLqaDataFile = lambda date, mode: \
+	join(getInputDirectory(mode), 'LqaData_' + date + '.bbg')
+
 
 
+@lru_cache(maxsize=3)
+def getLqaColumns(date, mode='production', separator='|'):
+	"""
+	[String] date (yyyymmdd), [String] mode
+		=> [Dictionary] LQA columns, see readLqaColumns()
 	"""
-	The below functions: 
+	return \
+	compose(
+		lambda file: readLqaColumns(file, separator)
+	  , lambda file: lognContinue('getLqaColumns(): from file: {0}'.format(file), file)
+	  , getLqaDataFile
+	)(date, mode)
 
-	1. stipDoubleQuote()
-	2. toNumberOrStripQuote()
-	3. updateSecurityId()
 
-	They are used to clean the data. Because sometimes the string data are 
-	enclosed by a pair of double quotes, we need to removed. The float numbers
-	may be read as string and sometimes we have security ids like "XS1234567890 PerfShs"
-	and we need to take only the first part.
+
+@timed('getLqaData')
+@lru_cache(maxsize=3)
+def getLqaData(date, mode='production', separator='|'):
+	"""
+	[String] date (yyyymmdd), [String] mode
+		=> [Mapping] id -> lqa data (dictionary)
+	"""
+	return LqaData(getLqaColumns(date, mode, separator))
+
+
+
+def readLqaColumns(file, separator='|'):
+	"""
+	[String] file (LQA response, .bbg), [String] separator
+		=> [Dictionary] LQA columns, like
+
+		{ 'Headers': [List] headers
+		, 'Index': [Dictionary] security id -> row number
+		, 'Columns': [Dictionary] header -> array of floats (numeric column)
+										 or list of values (other column)
+		, 'Exceptions': [Dictionary] header -> [Dictionary] row number -> 
+							string value (numeric column only)
+		}
+
+	Read the lines between 'START-OF-DATA' and 'END-OF-DATA'. Because sometimes
+	the string data are enclosed by a pair of double quotes, we need to remove
+	them. Sometimes we have security ids like "XS1234567890 PerfShs" and we 
+	need to take only the first part.
+
+	If a security appears more than once, the last row is used.
 	"""
 	stipDoubleQuote = lambda s: s.replace('"', '')
 
@@ -118,31 +305,234 @@ def getLqaData(date, mode='production', separator='|'):
 	def toNumberOrStripQuote(x):
 		try:
 			return float(x)
-		except:
+		except ValueError:
 			return stipDoubleQuote(x)
 
 
-	def updateSecurityId(p):
-		if len(p['SECURITIES'].split()[0]) == 12: # it's ISIN
-			return mergeDict(p, {'SECURITIES': p['SECURITIES'].split()[0]})
+	def updateSecurityId(securityId):
+		if len(securityId.split()) > 0 and len(securityId.split()[0]) == 12: # it's ISIN
+			return securityId.split()[0]
 		else:
-			return p
+			return securityId
+
+
+	def addNumber(column, exceptions, row, x):
+		try:
+			column.append(float(x))
+		except ValueError:
+			column.append(nan)
+			exceptions[row] = stipDoubleQuote(x)
+
+
+	def readLines(file):
+		with open(file, 'r') as lqaFile:
+			for line in lqaFile:
+				yield line.strip().split(separator)
+
+
+	lines = dropwhile(lambda L: L[0] != 'START-OF-DATA', readLines(file))
+	pop(lines)
+	headers = list(map(stipDoubleQuote, pop(lines)))
+	columns = { h: array('d') if h in lqaNumericColumns else [] for h in headers }
+	exceptions = { h: {} for h in headers if h in lqaNumericColumns }
+	index = {}
+
+	row = 0
+	for line in takewhile(lambda L: L[0] != 'END-OF-DATA', lines):
+		if line == ['']:
+			continue
+
+		for h, x in zip_longest(headers, line[:len(headers)], fillvalue=''):
+			if h in lqaNumericColumns:
+				addNumber(columns[h], exceptions[h], row, x)
+			elif h == 'SECURITIES':
+				columns[h].append(updateSecurityId(stipDoubleQuote(x)))
+			else:
+				columns[h].append(toNumberOrStripQuote(x))
+
+		index[columns['SECURITIES'][row]] = row
+		row = row + 1
+
+
+	return \
+	{ 'Headers': headers
+	, 'Index': index
+	, 'Columns': columns
+	, 'Exceptions': exceptions
+	}
+
+
+
+def getLqaRow(lqaColumns, row):
+	"""
+	[Dictionary] LQA columns, [Int] row number
+		=> [Dictionary] header -> value of that row
+	"""
+	return {h: getLqaValue(lqaColumns, h, row) for h in lqaColumns['Headers']}
+
+
+
+def getLqaValue(lqaColumns, header, row):
+	"""
+	[Dictionary] LQA columns, [String] header, [Int] row number
+		=> value of the column on that row
+	"""
+	return \
+	lqaColumns['Exceptions'][header][row] \
+	if header in lqaColumns['Exceptions'] and row in lqaColumns['Exceptions'][header] else \
+	lqaColumns['Columns'][header][row]
+
+
+
+class LqaData(Mapping):
+	"""
+	A read only view: security id -> lqa data (dictionary) over the LQA
+	columns. The dictionary of a security is built when it is looked up, so
+	that we don't keep one dictionary per security in memory.
+	"""
+	__slots__ = ('lqaColumns', )
+
+	def __init__(self, lqaColumns):
+		self.lqaColumns = lqaColumns
+
+	def __getitem__(self, securityId):
+		return getLqaRow(self.lqaColumns, self.lqaColumns['Index'][securityId])
+
+	def __contains__(self, securityId):
+		return securityId in self.lqaColumns['Index']
+
+	def __iter__(self):
+		return iter(self.lqaColumns['Index'])
+
+	def __len__(self):
+		return len(self.lqaColumns['Index'])
+
+
+
+class SecurityRecord(Mapping):
+	"""
+	What we know about a security on a date, joined from all the sources, see
+	getSecurityMaster(). A source that has nothing about the security is None.
+
+	As a Mapping, the record reads like the security's BlpData row, so a
+	security master can be given to the functions in asset.py in place of
+	blpData.
+	"""
+	__slots__ = ( 'blpData', 'liquidationHorizon', 'assetTypeSpecialCase'
+				, 'liquiditySpecialCase', 'liquidityOverride')
+
+	def __init__( self, blpData, liquidationHorizon, assetTypeSpecialCase
+				, liquiditySpecialCase, liquidityOverride):
+		self.blpData = blpData
+		self.liquidationHorizon = liquidationHorizon
+		self.assetTypeSpecialCase = assetTypeSpecialCase
+		self.liquiditySpecialCase = liquiditySpecialCase
+		self.liquidityOverride = liquidityOverride
+
+	def __getitem__(self, field):
+		if self.blpData == None:
+			raise KeyError(field)
+
+		return self.blpData[field]
+
+	def __iter__(self):
+		return iter(() if self.blpData == None else self.blpData)
+
+	def __len__(self):
+		return 0 if self.blpData == None else len(self.blpData)
+
+
+
+@timed('getSecurityMaster')
+@lru_cache(maxsize=3)
+def getSecurityMaster(date, mode='production', separator='|'):
+	"""
+	[String] date (yyyymmdd), [String] mode, [String] separator
+		=> [Dictionary] security id -> [SecurityRecord] record
+
+	Join BlpData, LQA data (liquidation horizon), asset type special cases,
+	liquidity special cases and liquidity overrides of the date by security
+	id, so that later a security is looked up once instead of once per
+	source.
+
+	BlpData is required. The LQA response and the liquidity special case file
+	are optional, because they are not needed by the asset allocation report,
+	so if one is missing, no security has data from it. Use getMissingData()
+	to find out securities without BlpData or LQA data.
+
+	A security that has no row in the LQA response of the date, because the
+	incremental LQA request of the date left it out (see lqa.py), takes the
+	liquidation horizon of the response it was left out for. Any other
+	security without a row has no LQA data.
+	"""
+	# lqa_store imports this module, so import it when it is used
+	from risk_report.lqa_store import getSkippedLiquidationHorizons
+
+	lqaColumns = \
+		getLqaColumns(date, mode, separator) \
+		if exists(getLqaDataFile(date, mode)) else \
+		lognWarning( 'getSecurityMaster(): no LQA data on {0}'.format(date)
+				   , {'Headers': [], 'Index': {}, 'Columns': {}, 'Exceptions': {}})
+
+	liquiditySpecialCases = \
+		getLiquiditySpecialCaseData(date, mode) \
+		if exists(getLiquiditySpecialCaseFile(date, mode)) else \
+		lognWarning('getSecurityMaster(): no liquidity special case on {0}'.format(date), {})
+
+	blpData = getBlpData(date, mode)
+	assetTypeSpecialCases = getAssetTypeSpecialCaseData()
+	overrides = getLiquidityOverrideOnDate(date)
+	lqaIndex = lqaColumns['Index']
+	skippedHorizons = getSkippedLiquidationHorizons(date, mode)
+
+
+	toRecord = lambda securityId: SecurityRecord(
+		blpData.get(securityId)
+	  , getLqaValue(lqaColumns, 'LQA_LIQUIDATION_HORIZON', lqaIndex[securityId]) \
+	  	if securityId in lqaIndex else skippedHorizons.get(securityId)
+	  , assetTypeSpecialCases.get(securityId)
+	  , liquiditySpecialCases.get(securityId)
+	  , overrides.get(securityId)
+	)
+
+
+	return \
+	{ securityId: toRecord(securityId) \
+		for securityId in chain( blpData, lqaIndex, assetTypeSpecialCases
+							   , liquiditySpecialCases, overrides)
+	}
+
+
+
+def getMissingData(securityMaster, securityIds):
+	"""
+	[Dictionary] security master, [Iterable] security ids
+		=> [Dictionary] security id -> [List] sources that have no data about
+			the security, 'BlpData' or 'LQA'
+
+	Securities that have data from all sources are not in the result. A
+	security with a liquidity override or liquidity special case does not
+	need LQA data. An LQA response without a liquidation horizon (like
+	'N.A.') counts as no LQA data.
+	"""
+	noHorizon = lambda horizon: \
+		not isinstance(horizon, (int, float)) or isnan(horizon)
+
+	missingSources = lambda record: \
+		['BlpData', 'LQA'] if record == None else \
+		( (['BlpData'] if record.blpData == None else [])
+		+ (['LQA'] if noHorizon(record.liquidationHorizon) \
+		  			and record.liquidityOverride == None \
+		  			and record.liquiditySpecialCase == None else [])
+		)
 
 
 	return \
 	compose(
 		dict
-	  , partial(map, lambda p: (p['SECURITIES'], p))
-	  , partial(map, updateSecurityId)
-	  , partial(map, partial(valmap, toNumberOrStripQuote))
-	  , lambda t: map(partial(toPosition, t[0]), t[1])
-	  , lambda lines: (list(map(stipDoubleQuote, pop(lines))), lines)
-	  , takeInBetween
-	  , partial(map, lambda line: line.split(separator))
-	  , fileToLines
-	  , lambda file: lognContinue('getLqaData(): from file: {0}'.format(file), file)
-	  , getLqaDataFile
-	)(date, mode)
+	  , partial(filter, lambda t: len(t[1]) > 0)
+	  , partial(map, lambda securityId: (securityId, missingSources(securityMaster.get(securityId))))
+	)(securityIds)
 
 
 
@@ -151,7 +541,31 @@ toDateString = lambda x: datetime.strftime(fromExcelOrdinal(x), '%Y%m%d')
 
 
 
-@lru_cache(maxsize=3)
+@lru_cache(maxsize=1)
+def getFXStore():
+	"""
+	=> [Dictionary] (date (yyyymmdd), reporting currency)
+			-> [Dictionary] currency -> exchange rate
+
+	FX.xlsx keeps the history of all dates, so we read it once and index the
+	rates by date and reporting currency, see getFX().
+	"""
+	def accumulate(acc, p):
+		acc.setdefault( (toDateString(p['Date']), p['Reporting Currency'])
+					  , {})[p['Currency']] = p['FX']
+		return acc
+
+
+	return \
+	compose(
+		lambda positions: reduce(accumulate, positions, {})
+	  , getRawPositionsFromFile
+	  , partial(join, getDataDirectory())
+	)('FX.xlsx')
+
+
+
+@lru_cache(maxsize=128)
 def getFX(date, targetCurrency):
 	"""
 	[String] date (yyyymmdd),
@@ -161,23 +575,50 @@ def getFX(date, targetCurrency):
 	Exchange rate: to get 1 unit of target currency, how many units of another 
 	currency is needed.
 
-	For example, d = loadFXTableFromFile('20200430', 'USD')
+	For example, d = getFX('20200430', 'USD')
 
 	Then
 
 	d['HKD'] = 7.7520 (USDHKD as of 20200430)
+
+	If FX.xlsx has no rates for the target currency on that date, the rates
+	are derived from another reporting currency on the same date, see
+	crossRates().
 	"""
+	getBaseCurrency = lambda date, targetCurrency: firstOf(
+		lambda currency: targetCurrency in getFXStore()[(date, currency)]
+	  , map(lambda t: t[1], filter(lambda t: t[0] == date, getFXStore().keys()))
+	)
+
+
 	return \
+	mergeDict({targetCurrency: 1.0}, getFXStore()[(date, targetCurrency)]) \
+	if (date, targetCurrency) in getFXStore() else \
 	compose(
-		partial(mergeDict, {targetCurrency: 1.0})
-	  , dict
-	  , partial(map, lambda p: (p['Currency'], p['FX']))
-	  , partial( filter
-	  		   , lambda p: toDateString(p['Date']) == date and p['Reporting Currency'] == targetCurrency
-	  		   )
-	  , getRawPositionsFromFile
-	  , partial(join, getDataDirectory())
-	)('FX.xlsx')
+		lambda base: \
+			lognContinue( 'getFX(): no FX rates for {0} on {1}'.format(targetCurrency, date)
+						, {targetCurrency: 1.0}) if base == None else \
+			crossRates( mergeDict({base: 1.0}, getFXStore()[(date, base)])
+					  , targetCurrency)
+	  , getBaseCurrency
+	)(date, targetCurrency)
+
+
+
+def crossRates(baseRates, targetCurrency):
+	"""
+	[Dictionary] baseRates (currency -> exchange rate of a base currency),
+	[String] targetCurrency
+		=> [Dictionary] currency -> exchange rate of the target currency
+
+	If 1 unit of the base currency = baseRates[X] units of currency X, then
+	1 unit of the target currency = baseRates[X] / baseRates[targetCurrency]
+	units of X.
+	"""
+	return mergeDict(
+		valmap(lambda rate: rate / baseRates[targetCurrency], baseRates)
+	  , {targetCurrency: 1.0}
+	)
 
 
 
@@ -215,15 +656,34 @@ def getLiquidityOverrideFromFile(file):
 
 
 
-getPositionDate = lambda position: \
-	getGenevaPositionDate(position) if isGenevaPosition(position) else \
-	getBlpPositionDate(position)
+def sourceAccessor(name):
+	"""
+	[String] accessor name (see position.accessorTables)
+		=> [Function] f(position) => the accessor of the position's source
+			applied to the position
+
+	A Position carries the accessor table of its source, so there is no need
+	to check the source again. A plain dictionary (like a position built in
+	a test) is told by its 'Remarks1' field.
+	"""
+	return lambda position: \
+		position.accessors[name](position) if isinstance(position, Position) else \
+		accessorTables['geneva' if isGenevaPosition(position) else 'bloomberg'][name](position)
 
 
 
-getQuantity = lambda position: \
-	getGenevaQuantity(position) if isGenevaPosition(position) else \
-	getBlpQuantity(position)
+""" [Dictionary] position => [Bool] is it a Geneva position """
+isFromGeneva = lambda position: \
+	position.source == 'geneva' if isinstance(position, Position) else \
+	isGenevaPosition(position)
+
+
+
+getPositionDate = sourceAccessor('getPositionDate')
+
+
+
+getQuantity = sourceAccessor('getQuantity')
 
 
 
@@ -234,18 +694,14 @@ getQuantity = lambda position: \
 	
 	# FIXME: is it true for Bloomberg positions?
 """
-getMarketValue = lambda position: \
-	getGenevaMarketValue(position) if isGenevaPosition(position) else \
-	getBlpMarketValue(position)
+getMarketValue = sourceAccessor('getMarketValue')
 
 
 
 """
 	[Dictionary] position => [String] book currency of the position
 """
-getBookCurrency = lambda position: \
-	getGenevaBookCurrency(position) if isGenevaPosition(position) else \
-	getBlpBookCurrency(position)
+getBookCurrency = sourceAccessor('getBookCurrency')
 
 
 
@@ -253,9 +709,7 @@ getBookCurrency = lambda position: \
 	[Dictionary] position (a Geneva or Blp position)
 		=> [Tuple] (id, idType)
 """
-getIdnType = lambda position: \
-	getGenevaIdnType(position) if isGenevaPosition(position) else \
-	getBlpIdnType(position)
+getIdnType = sourceAccessor('getIdnType')
 
 
 
@@ -263,39 +717,31 @@ getIdnType = lambda position: \
 	[Dictionary] position (a Geneva or Blp position)
 		=> [String] portfolio Id
 """
-getPortfolioId = lambda position: \
-	getGenevaPortfolioId(position) if isGenevaPosition(position) else \
-	getBlpPortfolioId(position)
+getPortfolioId = sourceAccessor('getPortfolioId')
 
 
 
-isPrivateSecurity = lambda position: \
-	isGenevaPrivateSecurity(position) if isGenevaPosition(position) else isBlpPrivateSecurity(position)
+isPrivateSecurity = sourceAccessor('isPrivateSecurity')
 
 
 
-isCash = lambda position: \
-	isGenevaCash(position) if isGenevaPosition(position) else isBlpCash(position)
+isCash = sourceAccessor('isCash')
 
 
 
-isMoneyMarket = lambda position: \
-	isGenevaMoneyMarket(position) if isGenevaPosition(position) else isBlpMoneyMarket(position) 
+isMoneyMarket = sourceAccessor('isMoneyMarket')
 
 
 
-isRepo = lambda position: \
-	isGenevaRepo(position) if isGenevaPosition(position) else isBlpRepo(position)
+isRepo = sourceAccessor('isRepo')
 
 
 
-isFxForward = lambda position: \
-	isGenevaFxForward(position) if isGenevaPosition(position) else isBlpFxForward(position)
+isFxForward = sourceAccessor('isFxForward')
 
 
 
-isFund = lambda position: \
-	isGenevaFund(position) if isGenevaPosition(position) else isBlpFund(position)
+isFund = sourceAccessor('isFund')
 
 
 
@@ -322,6 +768,42 @@ def getAllPositionsBlp(date, mode):
 	[String] date (yyyymmdd), [String] mode
 		=> [Iterator] positions of all portfolios on the date from Bloomberg
 	"""
+	return iter(getBlpPositionIndex(date, mode)['Positions'])
+
+
+
+"""
+	[String] portfolio, [String] date (yyyymmdd), [String] mode
+		=> [Iterator] positions of the Bloomberg account on the date
+"""
+getBlpPositions = lambda portfolio, date, mode: \
+	iter(getBlpPositionIndex(date, mode)['Accounts'].get(portfolio, ()))
+
+
+
+"""
+	[String] date (yyyymmdd), [String] mode
+		=> [List] account codes in the Bloomberg MAV export on the date
+"""
+getBlpAccounts = lambda date, mode: \
+	list(getBlpPositionIndex(date, mode)['Accounts'].keys())
+
+
+
+@lru_cache(maxsize=3)
+def getBlpPositionIndex(date, mode):
+	"""
+	[String] date (yyyymmdd), [String] mode
+		=> [Dictionary] index of the Bloomberg MAV export on the date, like
+
+		{ 'AsOfDate': date in the export file (yyyymmdd)
+		, 'Positions': [Tuple] all positions, in the order of the file
+		, 'Accounts': [Dictionary] account code -> [Tuple] positions
+		}
+
+	The export file contains positions of all Bloomberg accounts, so we read
+	it once per date and serve each account from the index.
+	"""
 	getBlpPositionFile = lambda date, mode: \
 		join(getInputDirectory(mode), 'risk_m2_mav_' + date + '.xlsx')
 
@@ -349,12 +831,13 @@ def getAllPositionsBlp(date, mode):
 
 
 	updatePosition = lambda date, position: \
-		mergeDict( position
-				 , { 'AsOfDate': date
-				   , 'Remarks1': 'Bloomberg MAV Risk-Mon Steven'
-				   , 'Account Code': floatToString(position['Account Code']) 
-				   }
-				 )
+		toPosition( 'bloomberg'
+				  , position
+				  , { 'AsOfDate': date
+					, 'Remarks1': 'Bloomberg MAV Risk-Mon Steven'
+					, 'Account Code': floatToString(position['Account Code']) 
+					}
+				  )
 
 
 	getPositions = lambda date, lines: \
@@ -366,20 +849,32 @@ def getAllPositionsBlp(date, mode):
 	)(lines)
 
 
+	toIndex = lambda asOfDate, positions: \
+		{ 'AsOfDate': asOfDate
+		, 'Positions': positions
+		, 'Accounts': valmap(tuple, groupbyToolz(getBlpPortfolioId, positions))
+		}
+
+
 	return \
 	compose(
-		lambda t: getPositions(t[0], t[1])
+		lambda t: toIndex(t[0], tuple(getPositions(t[0], t[1])))
 	  , lambda lines: (getDateFromLines(lines), lines)
-	  , fileToLines
-	  , lambda file: lognContinue('getAllPositionsBlp(): {0}'.format(file), file)
+	  , fileToLinesSnapshot
+	  , lambda file: lognContinue('getBlpPositionIndex(): {0}'.format(file), file)
 	  , getBlpPositionFile
 	)(date, mode)
 
 
 
-getBlpPositions = lambda portfolio, date, mode: \
-	filter( lambda p: getBlpPortfolioId(p) == portfolio
-		  , getAllPositionsBlp(date, mode))
+"""
+	[String] portfolio, [String] date (yyyymmdd), [String] mode
+		=> [String] Geneva investment positions file of the portfolio
+"""
+getGenevaInvestmentPositionFile = lambda portfolio, date, mode: \
+	join( getInputDirectory(mode)
+		, portfolio + '_Investment_Positions_' + date + '.xlsx'
+		)
 
 
 
@@ -395,25 +890,15 @@ def getGenevaPositions(portfolio, date, mode):
 	"""
 	readGenevaInvestmentPositionFile = compose(
 		partial( map
-			   , lambda p: mergeDict(p, {'Remarks1': 'Geneva investment positions report'})
+			   , lambda p: toPosition('geneva', p, {'Remarks1': 'Geneva investment positions report'})
 			   )
 
 	  , lambda lines: getPositions(lines)[1]
-	  , fileToLines
+	  , fileToLinesSnapshot
 	  , lambda file: lognContinue('readGenevaInvestmentPositionFile(): {0}'.format(file), file)
 	)
 
 
-	"""
-		[String] portfolio, [String] date (yyyymmdd), [String] mode
-			=> [String] file 
-	"""
-	getGenevaInvestmentPositionFile = lambda portfolio, date, mode: \
-		join( getInputDirectory(mode)
-			, portfolio + '_Investment_Positions_' + date + '.xlsx'
-			)
-
-
 	return \
 	compose(
 		readGenevaInvestmentPositionFile
@@ -435,7 +920,7 @@ def loadRatingScoreMappingFromFile(file):
 	  , partial(takewhile, lambda line: len(line) > 2 and line[0] != '')
 	  , lambda t: t[1]
 	  , lambda lines: (pop(lines), lines)
-	  , fileToLines
+	  , fileToLinesSnapshot
   	  , partial(join, getDataDirectory())
 	)(file)
 
@@ -453,7 +938,7 @@ def loadCountryGroupMappingFromFile(file):
 	  , partial(takewhile, lambda line: len(line) > 2 and line[0] != '')
 	  , lambda t: t[1]
 	  , lambda lines: (pop(lines), lines)
-	  , fileToLines
+	  , fileToLinesSnapshot
   	  , partial(join, getDataDirectory())
 	)(file)
 
@@ -486,8 +971,8 @@ def loadAssetTypeSpecialCaseFromFile(file):
 		dict
 	  , partial(map, lambda p: (p['ID'], p))
 	  , partial(map, updatePosition)
-	  , getRawPositions
-	  , fileToLines
+	  , getRawPositionsFromLines
+	  , fileToLinesSnapshot
 	  , partial(join, getDataDirectory())
 	)(file)
 
@@ -582,6 +1067,11 @@ def lognContinue(msg, x):
 	return x
 
 
+def lognWarning(msg, x):
+	logger.warning(msg)
+	return x
+
+
 def lognRaise(msg):
 	logger.error(msg)
-	raise ValueError
\ No newline at end of file
+	raise ValueError(msg)
\ No newline at end of file
@@ -0,0 +1,195 @@
+# coding=utf-8
+#
+# Instrumentation of a run: for each stage (a decorated function), record
+# the number of calls, wall time and number of items produced, plus the
+# hit/miss counts of cached loaders and other events (like snapshot hits).
+#
+# It is off by default, call enable() to start recording, then dumpStats()
+# at the end of a run to save the records as JSON.
+#
+from functools import wraps
+from time import perf_counter
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+_enabled = False
+_stages = {}
+_events = {}
+
+
+
+def enable():
+	global _enabled
+	_enabled = True
+
+
+
+def isEnabled():
+	return _enabled
+
+
+
+def getStageRecord(stage):
+	"""
+	[String] stage => [Dictionary] record of the stage
+	"""
+	return _stages.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'items': 0})
+
+
+
+def countEvent(event, n=1):
+	"""
+	[String] event, [Int] n => [Int] n
+
+	Side effect: add n to the count of the event, if enabled.
+	"""
+	if _enabled:
+		_events[event] = _events.get(event, 0) + n
+
+	return n
+
+
+
+isIterator = lambda x: hasattr(x, '__next__') and hasattr(x, '__iter__')
+
+
+
+def timedIterator(record, iterator):
+	"""
+	[Dictionary] stage record, [Iterator] iterator => [Iterator] the same items
+
+	The time spent in producing each item is added to the stage, the time
+	spent by the consumer is not.
+	"""
+	while True:
+		start = perf_counter()
+		try:
+			x = next(iterator)
+		except StopIteration:
+			record['seconds'] += perf_counter() - start
+			return
+
+		record['seconds'] += perf_counter() - start
+		record['items'] += 1
+		yield x
+
+
+
+def timed(stage):
+	"""
+	[String] stage => [Function] decorator
+
+	Decorate a function so that its calls are recorded under the stage. If
+	the function returns an iterator, the items are counted as they are
+	consumed, otherwise each call counts as one item.
+	"""
+	def decorator(func):
+		@wraps(func)
+		def wrapper(*args, **kwargs):
+			if not _enabled:
+				return func(*args, **kwargs)
+
+			record = getStageRecord(stage)
+			record['calls'] += 1
+			start = perf_counter()
+			result = func(*args, **kwargs)
+			record['seconds'] += perf_counter() - start
+
+			if isIterator(result):
+				return timedIterator(record, result)
+
+			record['items'] += 1
+			return result
+
+		return wrapper
+
+	return decorator
+
+
+
+def getCacheInfo(func):
+	"""
+	[Function] func => [Object] cache info of the lru_cache under func, or
+		None if func is not cached.
+	"""
+	while func != None:
+		if hasattr(func, 'cache_info'):
+			return func.cache_info()
+
+		func = getattr(func, '__wrapped__', None)
+
+	return None
+
+
+
+def getCacheStats(module):
+	"""
+	[Module] module => [Dictionary] function name -> cache statistics of
+		each cached function in the module
+	"""
+	toStats = lambda info: \
+		{ 'hits': info.hits, 'misses': info.misses
+		, 'size': info.currsize, 'maxsize': info.maxsize
+		}
+
+
+	return \
+	{ name: toStats(getCacheInfo(func)) \
+		for name, func in sorted(vars(module).items()) \
+		if callable(func) and getCacheInfo(func) != None
+	}
+
+
+
+def clearCaches(module):
+	"""
+	[Module] module => [Int] number of caches cleared
+
+	Side effect: clear the lru_cache of each cached function in the module.
+	"""
+	def getCachedFunction(func):
+		while func != None:
+			if hasattr(func, 'cache_clear'):
+				return func
+
+			func = getattr(func, '__wrapped__', None)
+
+		return None
+
+
+	cachedFunctions = list(filter( lambda func: func != None
+								 , map(getCachedFunction, filter(callable, vars(module).values()))))
+	for func in cachedFunctions:
+		func.cache_clear()
+
+	return len(cachedFunctions)
+
+
+
+def getStats(*modules):
+	"""
+	[Module] modules, whose cached functions are reported
+		=> [Dictionary] the records so far
+	"""
+	return \
+	{ 'stages': _stages
+	, 'events': _events
+	, 'caches': { module.__name__: getCacheStats(module) for module in modules }
+	}
+
+
+
+def dumpStats(file, *modules):
+	"""
+	[String] output file name, [Module] modules => [String] output file name
+
+	Side effect: write the records as JSON to the file.
+	"""
+	with open(file, 'w') as f:
+		json.dump(getStats(*modules), f, indent=2)
+
+	logger.info('dumpStats(): {0}'.format(file))
+	return file
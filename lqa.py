@@ -6,53 +6,73 @@
 # 2) Read LQA response
 # 
 
-from risk_report.data import getPortfolioPositions, getIdnType, getQuantity
-from risk_report.geneva import isGenevaPosition
+from risk_report.data import getPortfolioPositions, getIdnType, getQuantity, isFromGeneva
+from risk_report.lqa_store import openLqaStore, ingestLqaResponses, getLatestAnswers \
+								, saveSkippedSecurities
+from risk_report.position import withFields
 from utils.excel import fileToLines
 from utils.iter import pop
 from functools import partial, reduce
-from itertools import chain, filterfalse, dropwhile, takewhile
+from itertools import chain, dropwhile, takewhile
 from toolz.functoolz import compose
-from toolz.itertoolz import groupby as groupbyToolz
-from utils.utility import mergeDict, writeCsv
+from utils.utility import writeCsv
+from datetime import datetime
 from os.path import join
 import logging
 logger = logging.getLogger(__name__)
 
 
 
-def createLqaPositions(portfolio, date, mode='production'):
+def createLqaAggregates(portfolio, date, mode='production'):
 	"""
-	[String] portfolio, [String] date (yyyymmdd), [Function] writer
-		=> ( [Iterator] non-clo positions
-		   , [Iterator] clo positions
+	[String] portfolio, [String] date (yyyymmdd), [String] mode
+		=> ( [Dictionary] aggregate of non-clo positions
+		   , [Dictionary] aggregate of clo positions
 		   )
+
+	Positions are read once and each one is added to the aggregate of its
+	group (Geneva, Bloomberg non-CLO, Bloomberg CLO) as it comes, see
+	addToAggregate(). So memory is proportional to the number of securities,
+	not the number of positions, even for the 'all' portfolio.
 	"""
-	processGenevaPositions = compose(
-		getGenevaLqaPositions
-	  , partial(filter, isGenevaPosition)
-	)
+	# [Position] position => ([Int] group, [Position] LQA position) or None
+	toLqaPosition = lambda position: \
+		( lambda p: None if p == None else (0, p) )(toGenevaLqaPosition(position)) \
+		if isFromGeneva(position) else \
+		( lambda p: None if p == None else (2 if isCLOPosition(p) else 1, p) ) \
+			(toBlpLqaPosition(position))
 
 
-	processBlpPositions = compose(
-		getBlpLqaPositions
-	  , partial(filterfalse, isGenevaPosition)
-	)
+	def accumulate(acc, el):
+		t = toLqaPosition(el)
+		if t != None:
+			addToAggregate(acc[t[0]], t[1])
+
+		return acc
 
 
 	return compose(
-		lambda t: ( consolidate(chain(t[1], t[2]))
-				  , consolidate(t[0])
-				  )
-	  , lambda positions: ( *processBlpPositions(positions)
-						  , processGenevaPositions(positions)
-						  )
-	  , list
+		lambda t: (mergeAggregates(t[1], t[0]), t[2])
+	  , lambda positions: reduce(accumulate, positions, ({}, {}, {}))
 	  , getPortfolioPositions
 	)(portfolio, date, mode)
 
 
 
+def createLqaPositions(portfolio, date, mode='production'):
+	"""
+	[String] portfolio, [String] date (yyyymmdd), [String] mode
+		=> ( [Iterator] consolidated non-clo positions
+		   , [Iterator] consolidated clo positions
+		   )
+	"""
+	return compose(
+		lambda t: (fromAggregate(t[0]), fromAggregate(t[1]))
+	  , createLqaAggregates
+	)(portfolio, date, mode)
+
+
+
 def noNeedLiquidityGeneva(position):
 	"""
 	[Dictionary] position => [Bool] no need to measure liquidity
@@ -74,95 +94,71 @@ def noNeedLiquidityGeneva(position):
 
 
 
-def getGenevaLqaPositions(positions):
-	"""
-	[Iterable] positions => [Iterable] positions
-
-	Read Geneva consolidated tax lot positions, then do the following: 
-
-	1) take out those not suitable for liquidity test (cash, FX forward, etc.);
-	2) Add Id, IdType and Position fields for LQA processing.
-
-	"""
-
-	# [Dictonary] p => [Dictionary] enriched position with id and idType
-	addIdnType = compose(
-		lambda t: mergeDict(t[2], {'Id': t[0], 'IdType': t[1]})
-	  , lambda p: (*getIdnType(p), p)
-	)
-
+"""
+	[Position] position => [Position] position with 'Id' and 'IdType' for LQA
+"""
+addIdnType = compose(
+	lambda t: withFields(t[2], {'Id': t[0], 'IdType': t[1]})
+  , lambda p: (*getIdnType(p), p)
+)
 
-	return compose(
-		partial(map, addIdnType)
-	  , partial(filterfalse, noNeedLiquidityGeneva)
-	  , lambda positions: lognContinue('getGenevaLqaPositions(): start', positions)
-	)(positions)
 
 
+"""
+	[Position] Geneva position => [Position] LQA position, or None if the
+		position does not need liquidity measure
+"""
+toGenevaLqaPosition = lambda position: \
+	None if noNeedLiquidityGeneva(position) else addIdnType(position)
 
-def getBlpLqaPositions(positions):
-	"""
-	[Iterable] positions => ( [Iterable] CLO positions
-					 	    , [Iterable] nonCLO positions
-					 	    )
 
-	Read Bloomberg raw positions, then do the following: 
 
-	1) take out those not suitable to do liquidity test (cash, FX forward, etc.);
-	2) take out DIF fund positions, since they will come from Geneva;
-	2) split into clo and nonCLO positions.
+"""
+	[Position] Bloomberg position => [Bool] no need to measure liquidity
 
-	Return (CLO positions, nonCLO positions)
-	"""
-	removeUnwantedPositions = compose(
-		partial( filterfalse
-	  		   , lambda p: p['Asset Type'] in [ 'Cash', 'Foreign Exchange Forward'
-	  		   								  , 'Repo Liability', 'Money Market'] \
-					or p['Name'] in ['.FSFUND HK', 'CLFLDIF HK']	# open ended funds
-			   )
-	  
-	  , partial(filterfalse, lambda p: p['Position'] == '' or p['Position'] <= 0)
-	)
+	Cash, FX forward, repo, money market, open ended funds and positions
+	without quantity are not suitable for liquidity test.
+"""
+noNeedLiquidityBlp = lambda p: \
+	p['Position'] == '' or p['Position'] <= 0 \
+	or p['Asset Type'] in [ 'Cash', 'Foreign Exchange Forward'
+						  , 'Repo Liability', 'Money Market'] \
+	or p['Name'] in ['.FSFUND HK', 'CLFLDIF HK']	# open ended funds
 
 
-	# [Dictionary] position => [Dictioanry] position with id and idtype
-	updatePositionId = compose(
-		lambda t: mergeDict(t[2], {'Id': t[0], 'IdType': t[1]})
-	  , lambda position: (*getIdnType(position), position)
-	)
 
+"""
+	[Position] Bloomberg position => [Position] LQA position, or None if the
+		position does not need liquidity measure
+"""
+toBlpLqaPosition = lambda position: \
+	None if noNeedLiquidityBlp(position) else addIdnType(position)
 
-	isCLOPortfolio = lambda p: p['Account Code'] in \
-						['12229', '12734', '12366', '12630', '12549', '12550', '13007']
 
 
-	"""
-	[Iterable] positions => ( [Iterable] CLO positions
-							, [Iterable] non CLO positions
-							)
+""" [Position] Bloomberg position => [Bool] position is in a CLO portfolio """
+isCLOPosition = lambda p: p['Account Code'] in \
+					['12229', '12734', '12366', '12630', '12549', '12550', '13007']
 
-	Split the positions into All, CLO and non-CLO group
-	"""
-	splitCLO = lambda positions: \
-		reduce( lambda acc, el: ( chain(acc[0], [el])
-								, acc[1]
-								) if isCLOPortfolio(el) else \
-								
-								( acc[0]
-								, chain(acc[1], [el])
-								)
-	  		  , positions
-	  		  , ([], [])
-	  		  )
 
 
-	return \
-	compose(
-		splitCLO
-	  , partial(map, updatePositionId)
-	  , removeUnwantedPositions		
-	  , lambda positions: lognContinue('getBlpLqaPositions(): start', positions)
-	)(positions)
+"""
+	[String] name, [String] date (yyyy-mm-dd), [Position] position
+		=> [String] line of the position in the lqa request file
+"""
+toLqaLine = lambda name, date, position: \
+	', '.join([ position['Id']
+			  , position['IdType']
+			  , 'LQA_POSITION_TAG_1={0}'.format(name)
+			  , 'LQA_TGT_LIQUIDATION_VOLUME={0}'.format(position['Position'])
+			  , 'LQA_SOURCE_TGT_LIQUIDATION_COST={0}'.\
+			  		format('PR' if position['IdType'] == 'TICKER' else 'BA')
+			  , 'LQA_FACTOR_TGT_LIQUIDATION_COST={0}'.\
+			  		format(20 if position['IdType'] == 'TICKER' else 1)
+			  , 'LQA_TGT_LIQUIDATION_HORIZON=1'
+			  , 'LQA_TGT_COST_CONF_LEVL=95'
+			  , 'LQA_MODEL_AS_OF_DATE={0}'.format(date)
+			  ])
 
 
 
@@ -176,33 +172,89 @@ def buildLqaRequest(name, date, positions):
 	Side effect: create a lqa request file
 
 	This version builds a txt file that is ready to be submitted as a universe
-	file to the Bloomberg service center.
+	file to the Bloomberg service center. Lines are written as the positions
+	come, so the file content is not built in memory.
 	"""
-	lqaLine = lambda name, date, position: \
-		', '.join([ position['Id']
-				  , position['IdType']
-				  , 'LQA_POSITION_TAG_1={0}'.format(name)
-				  , 'LQA_TGT_LIQUIDATION_VOLUME={0}'.format(position['Position'])
-				  , 'LQA_SOURCE_TGT_LIQUIDATION_COST={0}'.\
-				  		format('PR' if position['IdType'] == 'TICKER' else 'BA')
-				  , 'LQA_FACTOR_TGT_LIQUIDATION_COST={0}'.\
-				  		format(20 if position['IdType'] == 'TICKER' else 1)
-				  , 'LQA_TGT_LIQUIDATION_HORIZON=1'
-				  , 'LQA_TGT_COST_CONF_LEVL=95'
-				  , 'LQA_MODEL_AS_OF_DATE={0}'.format(date)
-				  ])
-
-
 	lqaFile = 'LQA_request_'+ name + '_' + date + '.txt'
 
 	with open(lqaFile, 'w') as outputFile:
-		outputFile.write('\n'.join(map(partial(lqaLine, name, date), positions)))
+		for i, line in enumerate(map(partial(toLqaLine, name, date), positions)):
+			outputFile.write(line if i == 0 else '\n' + line)
 
 
 	return lqaFile
 
 
 
+def buildLqaRequestShards(name, date, positions, maxLines=None, byIdType=False):
+	"""
+	[String] name (name of the lqa request, 'masterlist' etc.)
+	[String] date (yyyy-mm-dd)
+	[Iterable] positions,
+	[Int] maxLines (maximum number of lines of a request file, None means no
+		limit),
+	[Bool] byIdType (put TICKER and ISIN securities into different files)
+		=> [String] output manifest file name
+
+	Side effect: create lqa request files (shards) and a manifest csv file
+	that lists the shards, with their id type and number of lines.
+
+	The same as buildLqaRequest(), except that the universe is split into
+	shards that can be submitted and processed in parallel. Shards are named
+	like
+
+	LQA_request_masterlist_TICKER_2020-05-29_1.txt (byIdType)
+	LQA_request_masterlist_2020-05-29_2.txt
+
+	Lines are written as the positions come, a shard is closed when it has
+	maxLines lines and the next line of its id type goes to a new shard.
+	"""
+	shardKey = lambda position: position['IdType'] if byIdType else ''
+
+	shardFile = lambda key, n: \
+		'LQA_request_' + name + ('_' + key if key != '' else '') \
+		+ '_' + date + '_' + str(n) + '.txt'
+
+
+	shards = {}			# [String] key -> [List] [file object, file name, lines]
+	shardCount = {}		# [String] key -> [Int] number of shards so far
+	manifest = []		# [List] (key, shard number, file name, lines) of closed shards
+
+	def closeShard(key):
+		outputFile, fileName, lines = shards.pop(key)
+		outputFile.close()
+		manifest.append((key, shardCount[key], fileName, lines))
+
+
+	def writeLine(key, line):
+		if key in shards and maxLines != None and shards[key][2] >= maxLines:
+			closeShard(key)
+
+		if not key in shards:
+			shardCount[key] = shardCount.get(key, 0) + 1
+			fileName = shardFile(key, shardCount[key])
+			shards[key] = [open(fileName, 'w'), fileName, 0]
+
+		shard = shards[key]
+		shard[0].write(line if shard[2] == 0 else '\n' + line)
+		shard[2] = shard[2] + 1
+
+
+	try:
+		for position in positions:
+			writeLine(shardKey(position), toLqaLine(name, date, position))
+	finally:
+		for key in list(shards.keys()):
+			closeShard(key)
+
+
+	return writeCsv( 'LQA_request_' + name + '_' + date + '_manifest.csv'
+				   , chain( [('File', 'IdType', 'Lines')]
+				   		  , map( lambda t: (t[2], t[0], t[3])
+				   		  	   , sorted(manifest, key=lambda t: (t[0], t[1])))))
+
+
+
 def buildLqaRequestOldStyle(name, date, positions):
 	"""
 	[String] name (name of the lqa request, 'masterlist_clo' etc.)
@@ -250,33 +302,189 @@ def buildLqaRequestOldStyle(name, date, positions):
 
 
 """
-	[List] group (positions of the same security) 
-		=> [Dictioanry] consolidated record
+	[Position] LQA position => [Float] quantity of the position
+
+	A consolidated position keeps its total quantity in the 'Position' field
+	(see fromAggregate()), that quantity is taken as it is. Otherwise
+	getQuantity() would convert it again, like multiplying the quantity of a
+	Bloomberg bond by 1000 a second time.
+"""
+getLqaQuantity = lambda position: \
+	position['Position'] if position.get('Consolidated', False) else getQuantity(position)
+
+
+
+def addToAggregate(aggregate, position):
+	"""
+	[Dictionary] aggregate, [Position] position => [Dictionary] aggregate
+
+	A running aggregate of LQA positions keeps, for each Id, the first
+	position of the security and the total quantity so far. For example,
+	adding
+
+	{'Id': '1 HK', 'Position': 100, ...}
+	{'Id': '1 HK', 'Position': 200, ...}
+
+	gives
+
+	{'1 HK': [{'Id': '1 HK', 'Position': 100, ...}, 300]}
+
+	The aggregate is updated in place, so that positions can be consolidated
+	as they are read, and memory is proportional to the number of securities
+	instead of the number of positions.
+	"""
+	entry = aggregate.get(position['Id'])
+	if entry == None:
+		aggregate[position['Id']] = [position, getLqaQuantity(position)]
+	else:
+		entry[1] = entry[1] + getLqaQuantity(position)
+
+	return aggregate
 
-	Example:
 
-	[ {'Id': '1 HK', 'Position': 100, ...}
-	  , {'Id': '1 HK', 'Position': 200, ...}
-	]
 
-	=>
+""" [Iterable] positions => [Dictionary] aggregate, see addToAggregate() """
+toAggregate = lambda positions: reduce(addToAggregate, positions, {})
 
-	{'Id': '1 HK', 'Position': 300, ...}
+
+
+def mergeAggregates(*aggregates):
+	"""
+	[Dictionary] aggregate, ... => [Dictionary] aggregate
+
+	Merge aggregates of different groups (like Geneva, Bloomberg CLO and
+	Bloomberg non-CLO) into a new one, the quantities of the same security
+	are added up. The first position of a security comes from the first
+	aggregate that has it. The input aggregates are not changed.
+	"""
+	def accumulate(acc, el):
+		securityId, (position, quantity) = el
+		if securityId in acc:
+			acc[securityId] = [acc[securityId][0], acc[securityId][1] + quantity]
+		else:
+			acc[securityId] = [position, quantity]
+
+		return acc
+
+
+	return reduce( accumulate
+				 , chain.from_iterable(map(lambda d: d.items(), aggregates))
+				 , {}
+				 )
+
+
+
+"""
+	[Dictionary] aggregate => [Iterator] consolidated positions
+
+	A consolidated position is the first position of the security, with the
+	total quantity in the 'Position' field.
 
 	NOTE: consolidated position is hard to tell whether it is a blp position or
-	a geneva position. Therefore we 'Position' field to store the total quantity.
+	a geneva position. Therefore we 'Position' field to store the total quantity,
+	and the 'Consolidated' field to tell the quantity is already converted.
+"""
+fromAggregate = lambda aggregate: \
+	map( lambda entry: withFields(entry[0], {'Position': entry[1], 'Consolidated': True})
+	   , aggregate.values())
+
+
+
+"""
+	[Iterable] positions => [Iterable] consolidated positions, one for each
+		security, in the order the securities first appear.
+
+	Consolidated positions can be consolidated again, say with positions of
+	another group, the quantities are not converted twice.
 """
-consolidateGroup = lambda group: \
-	mergeDict(group[0].copy(), {'Position': sum(map(getQuantity, group))})
+consolidate = compose(fromAggregate, toAggregate)
 
 
 
-"""[Iterable] positions => [Iterable] consolidated positions"""
-consolidate = compose(
-	  partial(map, consolidateGroup)
-	, lambda d: d.values()
-	, partial(groupbyToolz, lambda p: p['Id'])
-)	
+def getLatestLqaResponses(date, mode='production', separator='|'):
+	"""
+	[String] date (yyyymmdd), [String] mode, [String] separator
+		=> [Dictionary] security id -> ( [String] date of the latest response
+										 (yyyymmdd)
+									   , [Float] liquidation volume requested
+									   )
+
+	The latest response of each security on or before the date. A response
+	with an error code or without liquidation horizon does not count, because
+	the security has to be requested again.
+
+	New or changed response files (LqaData_<date>.bbg in the input directory)
+	are loaded into the LQA store first, see lqa_store.py.
+	"""
+	connection = openLqaStore(mode)
+	try:
+		ingestLqaResponses(connection, mode, separator)
+		return getLatestAnswers(connection, date)
+	finally:
+		connection.close()
+
+
+
+def needsLqaRequest(responses, date, maxAge, tolerance, position):
+	"""
+	[Dictionary] responses (see getLatestLqaResponses()),
+	[String] date (yyyymmdd),
+	[Int] maxAge (days),
+	[Float] tolerance (fraction of the quantity requested last time),
+	[Position] consolidated LQA position
+		=> [Bool] the security needs a new LQA request
+
+	A security needs a new request if
+
+	1. it has no past response;
+	2. its latest response is more than maxAge days before the date;
+	3. its quantity changed by more than the tolerance since the last request.
+	"""
+	if not position['Id'] in responses:
+		return True
+
+	responseDate, volume = responses[position['Id']]
+	return \
+	(datetime.strptime(date, '%Y%m%d') - datetime.strptime(responseDate, '%Y%m%d')).days > maxAge \
+	or abs(position['Position'] - volume) > tolerance * abs(volume)
+
+
+
+def getIncrementalLqaPositions(date, mode, maxAge, tolerance, positions, separator='|'):
+	"""
+	[String] date (yyyymmdd),
+	[String] mode,
+	[Int] maxAge (days),
+	[Float] tolerance,
+	[Iterable] consolidated LQA positions,
+	[String] separator
+		=> [List] positions that need a new LQA request, see
+			needsLqaRequest()
+
+	Securities with a fresh response for about the same quantity are left out,
+	so that they are not submitted again.
+
+	Side effect: the securities left out are saved to the LQA store with the
+	date of the response they are left out for, so that the security master
+	of the date takes their liquidation horizons from that response, see
+	lqa_store.getSkippedLiquidationHorizons().
+	"""
+	connection = openLqaStore(mode)
+	try:
+		ingestLqaResponses(connection, mode, separator)
+		responses = getLatestAnswers(connection, date)
+		positions = list(positions)
+		requested = list(filter( partial(needsLqaRequest, responses, date, maxAge, tolerance)
+							   , positions))
+
+		# a security is left out only if none of its positions is requested
+		skipped = set(map(lambda p: p['Id'], positions)) \
+					- set(map(lambda p: p['Id'], requested))
+		saveSkippedSecurities( connection, date
+							 , map(lambda securityId: (securityId, responses[securityId][0]), skipped))
+		return requested
+	finally:
+		connection.close()
 
 
 
@@ -287,7 +495,7 @@ def lognContinue(msg, x):
 
 def lognRaise(msg):
 	logger.error(msg)
-	raise ValueError
+	raise ValueError(msg)
 
 
 
@@ -309,6 +517,22 @@ if __name__ == '__main__':
 
 			$python lqa.py 19437 202000529 --old
 
+		To split a large request into files of at most 5000 lines, with TICKER
+		and ISIN securities in different files, do
+
+			$python lqa.py all 20200529 --max-lines 5000 --by-idtype
+
+		The shards are listed in LQA_request_masterlist_<date>_manifest.csv.
+
+		To request only the securities that are new, whose quantity changed by
+		more than 5%, or whose latest LQA response (LqaData_<date>.bbg in the
+		input directory, see lqa_store.py) is more than 30 days old, do
+
+			$python lqa.py all 20200529 --incremental --max-age 30 --tolerance 0.05
+
+		The securities left out are saved to the LQA store, the liquidity
+		report of the date uses the horizons of their latest responses.
+
 		If you want to build two output files with clo and non-clo separated,
 		uncomment the code block blow and run the program.
 	"""
@@ -321,24 +545,51 @@ if __name__ == '__main__':
 					   , help='date of the positions (yyyymmdd)')
 	parser.add_argument( '--old', type=str, nargs='?', const=True, default=False
 					   , help='use old style output for human inspection')
+	parser.add_argument( '--max-lines', type=int, default=None
+					   , help='split the request into files of at most this many lines')
+	parser.add_argument( '--by-idtype', type=str, nargs='?', const=True, default=False
+					   , help='split the request into TICKER and ISIN files')
+	parser.add_argument( '--incremental', type=str, nargs='?', const=True, default=False
+					   , help='request only securities without a fresh LQA response')
+	parser.add_argument( '--max-age', type=int, default=30
+					   , help='days before an LQA response is too old (default 30)')
+	parser.add_argument( '--tolerance', type=float, default=0.05
+					   , help='change in quantity that needs a new request (default 0.05)')
+	parser.add_argument( '--test', type=str, nargs='?', const=True, default=False
+					   , help='use test mode datastore')
 	args = parser.parse_args()
 
-	writer = buildLqaRequestOldStyle if args.old else buildLqaRequest
+	isSharded = args.max_lines != None or args.by_idtype
+	if isSharded and args.old:
+		parser.error('--old does not work with --max-lines or --by-idtype')
+
+	mode = 'test' if args.test else 'production'
+
+	# [Iterable] consolidated positions => [Iterable] positions to request
+	selectPositions = \
+		partial(getIncrementalLqaPositions, args.date, mode, args.max_age, args.tolerance) \
+		if args.incremental else (lambda positions: positions)
+
+	writer = buildLqaRequestOldStyle if args.old else \
+			partial( buildLqaRequestShards, maxLines=args.max_lines
+				   , byIdType=args.by_idtype) if isSharded else \
+			buildLqaRequest
 
 	# Choice 1: Create CLO and non-CLO separately
 	# compose(
-	# 	lambda t: ( writer('masterlist_nonCLO', args.date, t[0])
-	# 		  	  , writer('masterlist_CLO', args.date, t[1])
+	# 	lambda t: ( writer('masterlist_nonCLO', args.date, selectPositions(t[0]))
+	# 		  	  , writer('masterlist_CLO', args.date, selectPositions(t[1]))
 	# 		  	  )
 	#   , createLqaPositions
-	# )(args.portfolio, args.date)
+	# )(args.portfolio, args.date, mode)
 
 
 	# Choice 2: Create one combined masterlist, use this if you want to generate
 	# LQA request for just one portfolio, say 19437.
 	compose(
 		partial(writer, 'masterlist', args.date)
-	  , consolidate
-	  , lambda t: chain(t[0], t[1])
-	  , createLqaPositions
-	)(args.portfolio, args.date)
+	  , selectPositions
+	  , fromAggregate
+	  , lambda t: mergeAggregates(t[0], t[1])
+	  , createLqaAggregates
+	)(args.portfolio, args.date, mode)
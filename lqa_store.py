@@ -0,0 +1,339 @@
+# coding=utf-8
+#
+# A local store of past LQA responses.
+#
+# Each LQA response file (LqaData_<date>.bbg) is parsed once and its rows are
+# saved to an SQLite database, one row per (security, date). After that,
+# looking up the response of a security on a date, or the history of its
+# liquidation horizon, is an index lookup instead of parsing the .bbg files
+# again.
+#
+# There is one store per mode, under the LQA store directory (see
+# risk_report.config). A response file is identified by its size and last
+# modified time, if it changes, the rows of its date are loaded again.
+#
+# An incremental LQA request (lqa.py --incremental) leaves out securities with
+# a fresh response, the store keeps which ones and the response each of them
+# was left out for. The security master reads their liquidation horizons
+# from there, without changing the store.
+#
+from risk_report.utility import getInputDirectory, getLqaStoreDirectory
+from risk_report.data import readLqaColumns, getLqaDataFile
+from toolz.functoolz import compose
+from functools import partial
+from math import isnan
+from os import listdir, makedirs, stat
+from os.path import join, exists, abspath
+from pathlib import Path
+import sqlite3
+import re
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+"""
+	Columns of the LQA response kept in the store: column in the store ->
+	header in the response file
+"""
+storeColumns = \
+{ 'error_code': 'ERROR CODE'
+, 'position_tag': 'LQA_POSITION_TAG_1'
+, 'tgt_liquidation_volume': 'LQA_TGT_LIQUIDATION_VOLUME'
+, 'liquidity_sector': 'LQA_LIQUIDITY_SECTOR'
+, 'liquidation_cost': 'LQA_LIQUIDATION_COST'
+, 'tgt_liquidation_cost': 'LQA_TGT_LIQUIDATION_COST'
+, 'liquidation_horizon': 'LQA_LIQUIDATION_HORIZON'
+, 'time_to_cash': 'LQA_TIME_TO_CASH'
+}
+
+
+
+schema = \
+"""
+CREATE TABLE IF NOT EXISTS response_files
+( date TEXT PRIMARY KEY
+, size INTEGER NOT NULL
+, mtime INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS responses
+( security TEXT NOT NULL
+, date TEXT NOT NULL
+, error_code REAL
+, position_tag TEXT
+, tgt_liquidation_volume REAL
+, liquidity_sector TEXT
+, liquidation_cost REAL
+, tgt_liquidation_cost REAL
+, liquidation_horizon REAL
+, time_to_cash REAL
+, PRIMARY KEY (security, date)
+);
+
+CREATE INDEX IF NOT EXISTS responses_by_date ON responses (date);
+
+CREATE TABLE IF NOT EXISTS skipped
+( security TEXT NOT NULL
+, date TEXT NOT NULL
+, response_date TEXT NOT NULL
+, PRIMARY KEY (security, date)
+);
+"""
+
+
+
+""" [String] mode => [String] store file of the mode """
+getLqaStoreFile = lambda mode: \
+	join(getLqaStoreDirectory(mode), 'lqa_store_' + mode + '.db')
+
+
+
+"""
+	[String] mode => [List] dates (yyyymmdd) of the LQA responses
+		(LqaData_<date>.bbg) in the input directory, in ascending order
+"""
+getLqaResponseDates = lambda mode: \
+	sorted(map( lambda m: m.group(1)
+			  , filter(None, map( partial(re.match, r'^LqaData_(\d{8})\.bbg$')
+			  					, listdir(getInputDirectory(mode))))))
+
+
+
+def openLqaStore(mode, file=None):
+	"""
+	[String] mode, [String] store file (None means the store of the mode)
+		=> [sqlite3.Connection] connection to the store
+
+	The tables are created if the store is new.
+	"""
+	if file == None:
+		makedirs(getLqaStoreDirectory(mode), exist_ok=True)
+
+	connection = sqlite3.connect(getLqaStoreFile(mode) if file == None else file)
+	connection.executescript(schema)
+	return connection
+
+
+
+def toRows(date, lqaColumns):
+	"""
+	[String] date (yyyymmdd), [Dictionary] LQA columns (see data.readLqaColumns())
+		=> [Iterator] rows of the responses table
+
+	A number that is not available (like 'N.A.') is saved as NULL.
+	"""
+	columns = lqaColumns['Columns']
+
+	toValue = lambda x: None if isinstance(x, float) and isnan(x) else x
+
+	getValue = lambda header, row: \
+		toValue(columns[header][row]) if header in columns else None
+
+
+	return \
+	map( lambda t: ( t[0], date
+				   , *map(lambda header: getValue(header, t[1]), storeColumns.values())
+				   )
+	   , lqaColumns['Index'].items())
+
+
+
+def ingestLqaResponse(connection, mode, date, separator='|'):
+	"""
+	[sqlite3.Connection] connection, [String] mode, [String] date (yyyymmdd),
+	[String] separator
+		=> [Bool] the response file is loaded into the store
+
+	Side effect: load the rows of the response file of the date into the
+	store, unless the same version of the file is already there.
+	"""
+	file = getLqaDataFile(date, mode)
+	fileStat = stat(file)
+	version = (fileStat.st_size, fileStat.st_mtime_ns)
+
+	if connection.execute( 'SELECT size, mtime FROM response_files WHERE date = ?'
+						 , (date, )).fetchone() == version:
+		return False
+
+
+	logger.debug('ingestLqaResponse(): {0}'.format(file))
+	rows = toRows(date, readLqaColumns(file, separator))
+	with connection:
+		connection.execute('DELETE FROM responses WHERE date = ?', (date, ))
+		connection.executemany(
+			'INSERT INTO responses (security, date, {0}) VALUES ({1})'.format(
+				', '.join(storeColumns.keys())
+			  , ', '.join(['?'] * (len(storeColumns) + 2)))
+		  , rows)
+		connection.execute( 'INSERT OR REPLACE INTO response_files VALUES (?, ?, ?)'
+						  , (date, *version))
+
+	return True
+
+
+
+def ingestLqaResponses(connection, mode, separator='|'):
+	"""
+	[sqlite3.Connection] connection, [String] mode, [String] separator
+		=> [List] dates of the response files loaded
+
+	Side effect: load the response files in the input directory that are new
+	or changed since the last time into the store.
+	"""
+	return \
+	compose(
+		list
+	  , partial(filter, partial(ingestLqaResponse, connection, mode, separator=separator))
+	  , getLqaResponseDates
+	)(mode)
+
+
+
+def getLqaResponse(connection, securityId, date):
+	"""
+	[sqlite3.Connection] connection, [String] security id, [String] date
+		=> [Dictionary] column -> value of the response of the security on
+			the date, or None if there is no such response
+	"""
+	cursor = connection.execute( 'SELECT * FROM responses WHERE security = ? AND date = ?'
+							   , (securityId, date))
+	row = cursor.fetchone()
+
+	return None if row == None else \
+		dict(zip(map(lambda d: d[0], cursor.description), row))
+
+
+
+def getLiquidationHorizons(connection, securityId, startDate='00000000', endDate='99999999'):
+	"""
+	[sqlite3.Connection] connection, [String] security id,
+	[String] start date, [String] end date (yyyymmdd)
+		=> [List] (date, liquidation horizon) of the security between the two
+			dates, in ascending order of date. The horizon is None if the
+			response has no horizon.
+	"""
+	return connection.execute(
+		'SELECT date, liquidation_horizon FROM responses '
+		'WHERE security = ? AND date BETWEEN ? AND ? ORDER BY date'
+	  , (securityId, startDate, endDate)).fetchall()
+
+
+
+def getLatestAnswers(connection, date):
+	"""
+	[sqlite3.Connection] connection, [String] date (yyyymmdd)
+		=> [Dictionary] security id -> ( [String] date of the latest response
+										 (yyyymmdd)
+									   , [Float] liquidation volume requested
+									   )
+
+	Only responses on or before the date, without error and with a
+	liquidation horizon are counted.
+	"""
+	return \
+	dict(map( lambda row: (row[0], (row[1], row[2]))
+			, connection.execute(
+				'SELECT r.security, r.date, r.tgt_liquidation_volume '
+				'FROM responses r JOIN '
+				'( SELECT security, MAX(date) AS date FROM responses '
+				'  WHERE date <= ? AND error_code = 0 AND liquidation_horizon IS NOT NULL '
+				'  GROUP BY security '
+				') latest ON r.security = latest.security AND r.date = latest.date'
+			  , (date, ))))
+
+
+
+def saveSkippedSecurities(connection, date, skipped):
+	"""
+	[sqlite3.Connection] connection, [String] date (yyyymmdd),
+	[Iterable] (security id, date of its latest response) of the securities
+		left out of the LQA request of the date
+		=> [Int] number of securities saved
+
+	Side effect: replace the skipped securities of the date in the store.
+	"""
+	rows = list(map(lambda t: (t[0], date, t[1]), skipped))
+	with connection:
+		connection.execute('DELETE FROM skipped WHERE date = ?', (date, ))
+		connection.executemany('INSERT INTO skipped VALUES (?, ?, ?)', rows)
+
+	return len(rows)
+
+
+
+def getSkippedHorizons(connection, date):
+	"""
+	[sqlite3.Connection] connection, [String] date (yyyymmdd)
+		=> [Dictionary] security id -> [Float] liquidation horizon of the
+			response the security was left out of the LQA request of the
+			date for
+	"""
+	return 	dict(connection.execute(
+		'SELECT s.security, r.liquidation_horizon '
+		'FROM skipped s JOIN responses r '
+		'ON r.security = s.security AND r.date = s.response_date '
+		'WHERE s.date = ?'
+	  , (date, )))
+
+
+
+def getSkippedLiquidationHorizons(date, mode='production'):
+	"""
+	[String] date (yyyymmdd), [String] mode
+		=> [Dictionary] security id -> [Float] liquidation horizon, see
+			getSkippedHorizons()
+
+	The store is opened read only and nothing is loaded into it, so this is
+	safe to call from the reports, even in parallel. Without a store, or
+	without the skipped table (a store of an older version), the result is
+	empty.
+	"""
+	file = getLqaStoreFile(mode)
+	if not exists(file):
+		return {}
+
+	connection = sqlite3.connect(Path(abspath(file)).as_uri() + '?mode=ro', uri=True)
+	try:
+		if connection.execute( "SELECT name FROM sqlite_master "
+							   "WHERE type = 'table' AND name = 'skipped'").fetchone() == None:
+			return {}
+
+		return getSkippedHorizons(connection, date)
+	finally:
+		connection.close()
+
+
+
+
+if __name__ == '__main__':
+	import logging.config
+	logging.config.fileConfig('logging.config', disable_existing_loggers=False)
+
+	"""
+		Load the LQA responses in the input directory into the store, do
+
+			$python lqa_store.py
+
+		To show the liquidation horizons of a security over time, do
+
+			$python lqa_store.py --security "1299 HK Equity"
+	"""
+
+	import argparse
+	parser = argparse.ArgumentParser(description='Load and query past LQA responses.')
+	parser.add_argument( '--security', type=str, default=None
+					   , help='show the liquidation horizons of the security')
+	parser.add_argument( '--test', type=str, nargs='?', const=True, default=False
+					   , help='use test mode datastore')
+	args = parser.parse_args()
+
+	mode = 'test' if args.test else 'production'
+	connection = openLqaStore(mode)
+
+	print('loaded: {0}'.format(ingestLqaResponses(connection, mode)))
+	if args.security != None:
+		for date, horizon in getLiquidationHorizons(connection, args.security):
+			print(date, horizon)
+
+	connection.close()
@@ -9,30 +9,56 @@ from risk_report.asset import isPrivateSecurity, isCash, isMoneyMarket \
 							, isRepo, isFxForward, getIdnType, getAssetType \
 							, getAverageRatingScore, getCountryCode \
 							, byCountryFilter, countryNotApplicable \
-							, toCountryGroup, fallsInAssetType \
-							, getAverageRatingScore
+							, fallsInAssetType \
+							, getAverageRatingScore, compileAssetTypePlan, routeAssetType \
+							, compileCountryPlan, routeCountryGroup, classifyPosition, tryClassify
 from risk_report.sfc import readSfcTemplate
+from risk_report.instrument import timed
 from risk_report.data import getFX, getPortfolioPositions, getBlpData, getMarketValue \
-							, getBookCurrency, getLqaData, isCash, getLiquiditySpecialCaseData \
-							, getQuantity, getLiquidityOverrideOnDate
+							, getBookCurrency, isCash, getQuantity \
+							, getSecurityMaster, SecurityRecord, getMissingData
 from utils.iter import pop
 from utils.utility import writeCsv, mergeDict, fromExcelOrdinal
 from toolz.functoolz import compose, juxt
-from toolz.itertoolz import groupby as groupbyToolz
+from toolz.itertoolz import partition_all
 from toolz.dicttoolz import valmap
 from functools import partial, reduce
 from itertools import filterfalse, chain, takewhile
 from datetime import datetime
+from bisect import bisect_left
+from math import isnan
 from os.path import join
 import logging
 logger = logging.getLogger(__name__)
 
 
 
-def getLiquidityCategory(date, mode, blpData, lqaData, position):
+writeCsv = timed('writeCsv')(writeCsv)
+
+
+
+"""
+	Liquidity categories by liquidation horizon (days): L0 if horizon <= 3,
+	L1 if horizon <= 7, L2 if horizon <= 10, otherwise L3.
+"""
+liquidityThresholds = (3, 7, 10)
+liquidityCategories = ('L0', 'L1', 'L2', 'L3')
+
+
+
+""" [Float] liquidation horizon => [String] liquidity category """
+toLiquidityCategory = lambda liquidityHorizon: \
+	liquidityCategories[bisect_left(liquidityThresholds, liquidityHorizon)] \
+	if isinstance(liquidityHorizon, (int, float)) and not isnan(liquidityHorizon) else \
+	lognRaise('toLiquidityCategory(): invalid liquidation horizon {0}'.format(liquidityHorizon))
+
+
+
+@timed('getLiquidityCategory')
+def getLiquidityCategory(date, securityMaster, position):
 	"""
 	[String] date (yyyymmdd),
-	[Dictionary] lqaData,
+	[Dictionary] securityMaster (see data.getSecurityMaster()),
 	[Dictionary] position
 		=> [Int] liquidity category
 	
@@ -45,58 +71,67 @@ def getLiquidityCategory(date, mode, blpData, lqaData, position):
 	"""
 	logger.debug('getLiquidityCategory(): {0}'.format(getIdnType(position)))
 
-	toLiquiditCategory = lambda liquidityHorizon: \
-		'L0' if liquidityHorizon <= 3 else \
-		'L1' if liquidityHorizon <= 7 else \
-		'L2' if liquidityHorizon <= 10 else 'L3'
+	isLiquidAsset = lambda securityMaster, position: \
+		True if getAssetType(securityMaster, position) in \
+			(('Cash', ), ('Fixed Income', 'Cash Equivalents')) else False
 
 
-	isLiquidAsset = lambda blpData, position: \
-		True if getAssetType(blpData, position) in \
-			(('Cash', ), ('Fixed Income', 'Cash Equivalents')) else False
+	record = getSecurityRecord(securityMaster, position)
 
+	return \
+	'L0' if isLiquidAsset(securityMaster, position) or getQuantity(position) == 0 else \
+	record.liquidityOverride if record.liquidityOverride != None else \
+	getLiquidityCategorySpecialCase(date, securityMaster, position) \
+	if record.liquiditySpecialCase != None else \
+	toLiquidityCategory(getLiquidationHorizon(record, position))
 
-	isLiquiditySpecialCase = lambda date, mode, position: \
-		getIdnType(position)[0] in getLiquiditySpecialCaseData(date, mode)
 
 
-	hasLiquidityOverride = lambda date, position: \
-		getIdnType(position)[0] in getLiquidityOverrideOnDate(date)
+"""
+	[Dictionary] securityMaster, [Dictionary] position
+		=> [SecurityRecord] record of the position's security, an empty record
+			if the security is not in the security master.
+"""
+getSecurityRecord = lambda securityMaster, position: \
+	securityMaster.get( getIdnType(position)[0]
+					  , SecurityRecord(None, None, None, None, None))
 
 
-	return \
-	'L0' if isLiquidAsset(blpData, position) or getQuantity(position) == 0 else \
-	getLiquidityOverrideOnDate(date)[getIdnType(position)[0]] \
-	if hasLiquidityOverride(date, position) else \
-	getLiquidityCategorySpecialCase(date, mode, blpData, position) \
-	if isLiquiditySpecialCase(date, mode, position) else \
-	toLiquiditCategory(lqaData[getIdnType(position)[0]]['LQA_LIQUIDATION_HORIZON'])
+
+"""
+	[SecurityRecord] record, [Dictionary] position
+		=> [Float] LQA liquidation horizon of the position's security
+"""
+getLiquidationHorizon = lambda record, position: \
+	lognRaise('getLiquidationHorizon(): no LQA data for {0}'.format(getIdnType(position))) \
+	if record.liquidationHorizon == None else record.liquidationHorizon
 
 
 
-def getLiquidityCategorySpecialCase(date, mode, blpData, position):
+def getLiquidityCategorySpecialCase(date, securityMaster, position):
 	"""
 	[String] date (yyyymmdd),
-	[Dictionary] lqaData,
+	[Dictionary] securityMaster,
 	[Dictionary] position
 		=> [Int] liquidity category
 	"""
 	logger.debug('getLiquidityCategorySpecialCase(): {0}'.format(getIdnType(position)))
 
+	specialCase = getSecurityRecord(securityMaster, position).liquiditySpecialCase
+
 
-	# [String] date, [String] mode => [Int] score
+	# [Dictionary] special case => [Int] score
 	maturityScore = compose(
 		lambda yearToMaturity: 4 if yearToMaturity < 1 else \
 			3 if yearToMaturity < 3 else \
 			2 if yearToMaturity < 5 else 1
 	  , lambda delta: delta.days // 365
 	  , lambda maturityDate: maturityDate - datetime.strptime(date, '%Y%m%d')
-	  , lambda d: d[getIdnType(position)[0]]['CALC_MATURITY']
-	  , getLiquiditySpecialCaseData
+	  , lambda specialCase: specialCase['CALC_MATURITY']
 	)
 
 
-	# [Dictionary] blpData, [Dictionary] position => [Int] score
+	# [Dictionary] securityMaster, [Dictionary] position => [Int] score
 	ratingScore = compose(
 		lambda score: 4 if score >= 15 else \
 			3 if score >= 12 else \
@@ -105,14 +140,13 @@ def getLiquidityCategorySpecialCase(date, mode, blpData, position):
 	)
 
 
-	# [String] date, [String] mode => [Int] score
+	# [Dictionary] special case => [Int] score
 	concentrationScore = compose(
 		lambda percentage: 4 if percentage < 5 else \
 			3 if percentage < 10 else \
 			2 if percentage < 20 else 1
 	  , lambda outStandingAmount: getQuantity(position)/outStandingAmount * 100
-	  , lambda d: d[getIdnType(position)[0]]['AMT_OUTSTANDING']
-	  , getLiquiditySpecialCaseData
+	  , lambda specialCase: specialCase['AMT_OUTSTANDING']
 	)
 
 
@@ -123,14 +157,72 @@ def getLiquidityCategorySpecialCase(date, mode, blpData, position):
 
 
 	return liquidityRating(
-			  	maturityScore(date, mode) \
-			  + ratingScore(blpData, position) \
-			  + concentrationScore(date, mode)
+			  	maturityScore(specialCase) \
+			  + ratingScore(securityMaster, position) \
+			  + concentrationScore(specialCase)
 	 	   )
 
 
 
 
+@timed('getLiquidityCategories')
+def getLiquidityCategories(date, securityMaster, positions, report=None):
+	"""
+	[String] date (yyyymmdd),
+	[Dictionary] securityMaster (see data.getSecurityMaster()),
+	[List] positions,
+	[Dictionary] exception report (None means raise on the first failure)
+		=> [List] liquidity category of each position
+
+	The batch version of getLiquidityCategory(), gives the same result for
+	each position. Each position's security is looked up once in the security
+	master, then the liquidation horizons of the positions that need LQA data
+	are bucketed in one go.
+
+	With an exception report, the category of a position that fails is None
+	and the reason is saved in the report, see asset.tryClassify().
+	"""
+	records = list(map(partial(getSecurityRecord, securityMaster), positions))
+
+
+	isLiquidAsset = lambda position: \
+		getAssetType(securityMaster, position) in (('Cash', ), ('Fixed Income', 'Cash Equivalents')) \
+		or getQuantity(position) == 0
+
+
+	# [Int] i => [String] category if it can be determined without LQA data,
+	# otherwise 'LQA'
+	getCategoryWithoutLqa = lambda i: \
+		'L0' if isLiquidAsset(positions[i]) else \
+		records[i].liquidityOverride if records[i].liquidityOverride != None else \
+		getLiquidityCategorySpecialCase(date, securityMaster, positions[i]) \
+		if records[i].liquiditySpecialCase != None else 'LQA'
+
+
+	categories = list(map( lambda i: tryClassify( report, 'Liquidity'
+												, lambda _: getCategoryWithoutLqa(i)
+												, positions[i])
+						 , range(len(positions))))
+	lqaRows = [i for i in range(len(positions)) if categories[i] == 'LQA']
+	for i in lqaRows:
+		categories[i] = tryClassify( report, 'LiquidationHorizon'
+								   , lambda position: toLiquidityCategory(getLiquidationHorizon(records[i], position))
+								   , positions[i])
+
+	return categories
+
+
+
+
+"""
+	[Dictionary] position => [Bool] the position does not need Bloomberg data
+		by its (id, idType)
+"""
+noNeedId = lambda position: \
+	any(juxt(isPrivateSecurity, isCash, isMoneyMarket, isRepo, isFxForward)(position))
+
+
+
 def writeIdnTypeToFile(file, positions):
 	"""
 	[String] output file name, [Iterator] positions
@@ -142,10 +234,6 @@ def writeIdnTypeToFile(file, positions):
 	to a file containing two columns (id, idType). The file will used to load
 	Bloomberg information for asset type processing.
 	"""
-	noNeedId = lambda position: \
-		any(juxt(isPrivateSecurity, isCash, isMoneyMarket, isRepo, isFxForward)(position))
-
-
 	return \
 	compose(
 		lambda idnTypes: writeCsv(file, chain([('ID', 'ID_TYPE')], idnTypes))
@@ -277,7 +365,8 @@ def getTotalMarketValueFromAssetType( date
 
 
 
-def writeAssetAllocationCsv(portfolio, date, mode, reportingCurrency, countryGroups, assetTypeTuples):
+def writeAssetAllocationCsv( portfolio, date, mode, reportingCurrency, countryGroups
+						   , assetTypeTuples, collectErrors=False):
 	"""
 	[String] portfolio,
 	[String] date (yyyymmdd),
@@ -285,27 +374,34 @@ def writeAssetAllocationCsv(portfolio, date, mode, reportingCurrency, countryGro
 	[String] reportingCurrency
 	[List] countries, (e.g., ['China - Hong Kong', 'China - Mainland', 'Singapore'])
 	[List] assetTypeTuples (each assetTypeTuple is like ('Fixed Income', 'Corporate', 'Investment Grade'))
+	[Bool] collectErrors
 		
 		=> [String] output csv file name
 
 	Side effect: create a csv file.
-	"""
-	assetTypeToValues = lambda d, countryGroups, assetypeTuple: \
-	compose(
-		partial(map, partial(sumMarketValueInCurrency, date, reportingCurrency))
-	  , lambda d: map(lambda cg: d[cg], countryGroups)
-	  , lambda assetypeTuple: d[assetypeTuple]
-	)(assetypeTuple)
 
+	In collect errors mode, positions that cannot be classified are left out
+	of the report and written to an exception report csv file, see
+	writeExceptionReport(), instead of stopping at the first one.
+	"""
+	report = {} if collectErrors else None
 
-	return \
+	file = \
 	compose(
 		partial(writeCsv, portfolio + '_asset_allocation_' + date + '.csv')
-	  , lambda d: map(partial(assetTypeToValues, d, countryGroups), assetTypeTuples)
-	  , partial(getAssetCountryAllocation, date, getBlpData(date, mode), assetTypeTuples, countryGroups)
+	  , lambda d: map( lambda assetTypeTuple: map(lambda cg: d[assetTypeTuple][cg], countryGroups)
+	  				 , assetTypeTuples)
+	  , lambda positions: getAssetCountryTotals( date, getBlpData(date, mode), reportingCurrency
+	  										   , assetTypeTuples, countryGroups, positions
+	  										   , report)
 	  , getPortfolioPositions
 	)(portfolio, date, mode)
 
+	if collectErrors:
+		writeExceptionReport(portfolio + '_asset_allocation_exceptions_' + date + '.csv', report)
+
+	return file
+
 
 
 def getAssetTypeAllocation(date, blpData, assetTypeTuples, positions):
@@ -317,13 +413,17 @@ def getAssetTypeAllocation(date, blpData, assetTypeTuples, positions):
 		=> [Dictionary] assetypeTuple -> list of positions matching that 
 				asset type
 
-	Each position will be allocated to the first asset type it matches.
+	Each position will be allocated to the first asset type it matches, and
+	appended to the list of that asset type, so the cost is linear in the
+	number of positions.
 	"""
+	assetTypeTuples = list(assetTypeTuples)
+	plan = compileAssetTypePlan(assetTypeTuples)
+
 	def accumulate(acc, el):
-		for assetType in acc:
-			if fallsInAssetType(blpData, assetType, el):
-				acc[assetType] = chain(acc[assetType], [el])
-				break
+		assetType = routeAssetType(plan, blpData, el)
+		if assetType != None:
+			acc[assetType].append(el)
 
 		return acc
 
@@ -344,22 +444,28 @@ def getCountryGroupAllocation(date, blpData, countryGroups, positions):
 		=> [Dictionary] country group -> list of positions in that country
 			group
 
-	Each position will be allocated to the first asset type it matches.
+	Positions whose country group is not in countryGroups are dropped. Each
+	position is appended to the list of its country group, so the cost is
+	linear in the number of positions and the lists can be of any length.
 	"""
+	plan = compileCountryPlan(countryGroups)
+
 	def accumulate(acc, el):
-		cg = toCountryGroup(blpData, el)
-		try:
-			acc[cg] = chain(acc[cg], [el])
-		except KeyError:
-			pass
+		column = routeCountryGroup(plan, blpData, el)
+		if column >= 0:
+			acc[column].append(el)
 
 		return acc
 
 
-	return reduce( accumulate
-				 , positions
-				 , {cg: [] for cg in countryGroups}
-				 )
+	return \
+	compose(
+		dict
+	  , lambda buckets: zip(plan['CountryGroups'], buckets)
+	)(reduce( accumulate
+			, positions
+			, [[] for _ in plan['CountryGroups']]
+			))
 
 
 
@@ -372,39 +478,129 @@ def getAssetCountryAllocation(date, blpData, assetTypeTuples, countryGroups, pos
 	[Iterator] positions
 		=> [Dictionary] assetypeTuple -> [Dictionary] countryGroup -> List of
 			positions that fall into this asset type and this country group
+
+	Each position is routed to its first matching asset type and then to its
+	country group in a single pass, see asset.compileAssetTypePlan().
+	"""
+	assetTypeTuples = list(assetTypeTuples)
+	plan = compileAssetTypePlan(assetTypeTuples)
+	countryPlan = compileCountryPlan(countryGroups)
+
+	def accumulate(acc, el):
+		assetType = routeAssetType(plan, blpData, el)
+		if assetType != None:
+			column = routeCountryGroup(countryPlan, blpData, el)
+			if column >= 0:
+				acc[assetType][column].append(el)
+
+		return acc
+
+
+	return \
+	valmap( lambda buckets: dict(zip(countryPlan['CountryGroups'], buckets))
+		  , reduce( accumulate
+				  , positions
+				  , { assetType: [[] for _ in countryPlan['CountryGroups']]
+				  	  for assetType in assetTypeTuples
+				  	}
+				  ))
+
+
+
+def getAssetCountryTotals( date, blpData, reportingCurrency, assetTypeTuples, countryGroups
+						 , positions, report=None):
+	"""
+	[String] date (yyyymmdd),
+	[Dictionary] blpData,
+	[String] reportingCurrency,
+	[Iterator] assetTypeTuples,
+	[List] countryGroups,
+	[Iterator] positions,
+	[Dictionary] exception report (None means raise on the first failure)
+		=> [Dictionary] assetypeTuple -> [Dictionary] countryGroup -> [Float]
+			total market value in reporting currency of positions that fall
+			into this asset type and this country group
+
+	The running total version of getAssetCountryAllocation(). Positions are
+	added to the totals as they come and are not kept, so memory does not grow
+	with the number of positions, which matters for the 'all' portfolio.
+
+	With an exception report, a position that fails is left out of the totals
+	and the reason is saved in the report, see asset.tryClassify().
 	"""
+	assetTypeTuples = list(assetTypeTuples)
+	plan = compileAssetTypePlan(assetTypeTuples)
+	countryPlan = compileCountryPlan(countryGroups)
+	FX = getFX(date, reportingCurrency)
+
+	def accumulate(acc, el):
+		assetType = tryClassify(report, 'AssetType', partial(routeAssetType, plan, blpData), el)
+		if assetType != None:
+			column = tryClassify( report, 'CountryGroup'
+								, partial(routeCountryGroup, countryPlan, blpData), el)
+			if column != None and column >= 0:
+				acc[assetType][column] = acc[assetType][column] + marketValueWithFX(FX, el)
+
+		return acc
+
+
 	return \
-	valmap( partial(getCountryGroupAllocation, date, blpData, countryGroups)
-		  , getAssetTypeAllocation(date, blpData, assetTypeTuples, positions)
-		  )
+	valmap( lambda totals: dict(zip(countryPlan['CountryGroups'], totals))
+		  , reduce( accumulate
+				  , positions
+				  , { assetType: [0] * len(countryPlan['CountryGroups'])
+				  	  for assetType in assetTypeTuples
+				  	}
+				  ))
+
+
 
+"""
+	Number of positions classified together by getLiquidityCategories() in
+	getLiquidityDistribution(). Only one chunk of positions is in memory at a
+	time.
+"""
+liquidityChunkSize = 10000
 
 
-def getLiquidityDistribution(portfolio, date, mode, reportingCurrency, separator='|'):
+
+def getLiquidityDistribution(portfolio, date, mode, reportingCurrency, separator='|', report=None):
 	"""
 	[String] portfolio
 	[String] date (yyyymmdd),
 	[String] mode
 	[String] reportingCurrency
 	[String] separator
+	[Dictionary] exception report (None means raise on the first failure)
 
 		=> [Iterator] rows of liquidity distribution
 
 	Where each row consists of 3 items: liquidity category, total market value in
 	this category, % of total market value
+
+	Positions are read in chunks (see liquidityChunkSize) and added to running
+	totals per category, so the whole position list is never built.
+
+	With an exception report, positions without a liquidity category are left
+	out of the distribution, see getLiquidityCategories().
 	"""
-	getMarketValueForEachCategory = compose(
-		lambda d: map( lambda key: ( key
-	  							   , sumMarketValueInCurrency(date, reportingCurrency, d[key])
-	  							   )
-			         , d.keys()
-			         )
-	  , partial( groupbyToolz
-	  		   , partial( getLiquidityCategory, date, mode
-	  		   			, getBlpData(date, mode)
-	  		   			, getLqaData(date, mode, separator))
-	  		   )
-	)
+	FX = getFX(date, reportingCurrency)
+	securityMaster = getSecurityMaster(date, mode, separator)
+
+	# ([Dictionary] category -> total market value, [Float] total market value),
+	# [Tuple] positions
+	# 	=> ([Dictionary] category -> total market value, [Float] total market value)
+	def accumulate(acc, positions):
+		categoryTotals, total = acc
+		for category, marketValue in zip( getLiquidityCategories(date, securityMaster, positions, report)
+										, map(partial(marketValueWithFX, FX), positions)):
+			if category == None:
+				continue
+
+			categoryTotals[category] = categoryTotals.get(category, 0) + marketValue
+			total = total + marketValue
+
+		return (categoryTotals, total)
 
 
 	checkTotal = lambda tuples: \
@@ -416,15 +612,186 @@ def getLiquidityDistribution(portfolio, date, mode, reportingCurrency, separator
 	compose(
 		checkTotal
 	  , sorted
-	  , lambda t: map(lambda ct: (ct[0], ct[1], ct[1]/t[1]), t[0])
-	  , lambda positions: ( getMarketValueForEachCategory(positions)
-	  					  , sumMarketValueInCurrency(date, reportingCurrency, positions)
-	  					  )
-	  , list
+	  , lambda t: map(lambda ct: (ct[0], ct[1], ct[1]/t[1]), t[0].items())
+	  , lambda positions: reduce( accumulate
+	  							, partition_all(liquidityChunkSize, positions)
+	  							, ({}, 0))
 	)(getPortfolioPositions(portfolio, date, mode))
 
 
 
+def writeLiquidityCsv(portfolio, date, mode, reportingCurrency, collectErrors=False):
+	"""
+	[String] portfolio,
+	[String] date (yyyymmdd),
+	[String] mode,
+	[String] reportingCurrency,
+	[Bool] collectErrors
+		=> [String] output csv file name
+
+	Side effect: create a csv file containing the liquidity distribution.
+
+	In collect errors mode, positions without a liquidity category (e.g., no
+	LQA data) are left out of the distribution and written to an exception
+	report csv file, see writeExceptionReport(), instead of stopping at the
+	first one.
+	"""
+	report = {} if collectErrors else None
+
+	file = \
+	compose(
+		partial(writeCsv, portfolio + '_liquidity_' + date + '.csv')
+	  , lambda rows: chain([('Category', 'Total', 'Percentage')], rows)
+	  , partial(getLiquidityDistribution, report=report)
+	)(portfolio, date, mode, reportingCurrency)
+
+	if collectErrors:
+		writeExceptionReport(portfolio + '_liquidity_exceptions_' + date + '.csv', report)
+
+	return file
+
+
+
+def writeExceptionReport(file, report):
+	"""
+	[String] output file name,
+	[Dictionary] exception report (see asset.classifyPositions())
+		=> [String] output file name
+
+	Side effect: create a csv file with a row for each field that failed for
+	a security, with the reason.
+	"""
+	if len(report) > 0:
+		logger.warning('writeExceptionReport(): {0} securities failed, see {1}'.format(len(report), file))
+
+	return writeCsv( file
+				   , chain( [('ID', 'ID_TYPE', 'Portfolio', 'Field', 'Reason')]
+						  , ( (*key, field, reason) \
+								for key, errors in report.items() \
+								for field, reason in errors.items())
+						  ))
+
+
+
+def validatePositions(date, mode, positions, separator='|'):
+	"""
+	[String] date (yyyymmdd), [String] mode, [Iterator] positions,
+	[String] separator
+		=> [Dictionary] validation result, like
+
+		{ 'IdnTypes': [Set] (id, idType) of positions that need Bloomberg data
+		, 'MissingBlpData': [Set] (id, idType) of securities not in BlpData
+		, 'AssetType': [Dictionary] (id, idType) -> error, securities without
+			an asset type
+		, 'Rating': [Set] (id, idType) of FI securities without credit rating
+		, 'Country': [Dictionary] (id, idType) -> error, securities without
+			a country group
+		, 'MissingLqa': [Set] (id, idType) of securities without LQA data
+		, 'Cash': [Float] total market value of cash in USD
+		, 'Positions': [Int] number of positions
+		}
+
+	The checks of step 1 - 5 in the main section plus the missing liquidity
+	check, done in one pass over the positions. A check that fails for a
+	position is recorded and the pass goes on, so one run finds all the
+	problems. Asset type and country group come from the collect errors mode
+	of asset.classifyPosition(), the checks that depend on the asset type are
+	skipped for a position without one.
+	"""
+	blpData = getBlpData(date, mode)
+	securityMaster = getSecurityMaster(date, mode, separator)
+	FX = getFX(date, 'USD')
+
+	isLiquidAsset = lambda assetType: \
+		assetType in (('Cash', ), ('Fixed Income', 'Cash Equivalents'))
+
+	# [Dictionary] position => [Bool] no credit rating for the position
+	noRating = lambda position: \
+		getAverageRatingScore(blpData, position, lambda position: None) == None
+
+
+	def accumulate(acc, el):
+		acc['Positions'] = acc['Positions'] + 1
+		idnType = getIdnType(el)
+		missingData = [] if noNeedId(el) else \
+						getMissingData(securityMaster, [idnType[0]]).get(idnType[0], [])
+
+		if not noNeedId(el):
+			acc['IdnTypes'].add(idnType)
+		if 'BlpData' in missingData:
+			acc['MissingBlpData'].add(idnType)
+
+		classification = classifyPosition(blpData, el, collectErrors=True)
+		if 'AssetType' in classification['Errors']:
+			acc['AssetType'][idnType] = classification['Errors']['AssetType']
+			return acc
+
+		assetType = classification['AssetType']
+		if assetType == ('Cash', ):
+			acc['Cash'] = acc['Cash'] + marketValueWithFX(FX, el)
+
+		if ratingsApplicable(assetType):
+			try:
+				if noRating(el):
+					acc['Rating'].add(idnType)
+			except Exception:
+				acc['Rating'].add(idnType)
+
+		if 'CountryGroup' in classification['Errors']:
+			acc['Country'][idnType] = classification['Errors']['CountryGroup']
+
+		if not isLiquidAsset(assetType) and getQuantity(el) != 0 \
+			and 'LQA' in missingData:
+			acc['MissingLqa'].add(idnType)
+
+		return acc
+
+
+	return reduce( accumulate
+				 , positions
+				 , { 'IdnTypes': set(), 'MissingBlpData': set(), 'AssetType': {}
+				   , 'Rating': set(), 'Country': {}, 'MissingLqa': set()
+				   , 'Cash': 0, 'Positions': 0
+				   })
+
+
+
+def writeValidationCsv(portfolio, date, mode, separator='|'):
+	"""
+	[String] portfolio, [String] date (yyyymmdd), [String] mode,
+	[String] separator
+		=> [Dictionary] validation result, see validatePositions(), with
+			'Files': [List] output csv file names
+
+	Side effect: validate the portfolio positions and write the exception
+	files, one for each check, so that they replace step 1 - 5 of the asset
+	allocation report and step 1 of the liquidity report. A file is written
+	even if it has no exceptions, so that an old file is not mistaken for the
+	latest.
+	"""
+	result = validatePositions( date, mode, getPortfolioPositions(portfolio, date, mode)
+							  , separator)
+
+	toFile = lambda name: portfolio + '_' + name + '_' + date + '.csv'
+
+	write = lambda name, headers, rows: \
+		writeCsv(toFile(name), chain([headers], sorted(rows)))
+
+	return mergeDict(
+		result
+	  , {'Files': [ write('idntype', ('ID', 'ID_TYPE'), result['IdnTypes'])
+				  , write('missing_blpdata', ('ID', 'ID_TYPE'), result['MissingBlpData'])
+				  , write( 'asset_type_errors', ('ID', 'ID_TYPE', 'Error')
+				  		 , map(lambda t: (*t[0], t[1]), result['AssetType'].items()))
+				  , write('missing_rating', ('ID', 'ID_TYPE'), result['Rating'])
+				  , write( 'country_errors', ('ID', 'ID_TYPE', 'Error')
+				  		 , map(lambda t: (*t[0], t[1]), result['Country'].items()))
+				  , write('missing_liquidity', ('ID', 'ID_TYPE'), result['MissingLqa'])
+				  ]}
+	)
+
+
+
 def lognContinue(msg, x):
 	logger.debug(msg)
 	return x
@@ -432,7 +799,7 @@ def lognContinue(msg, x):
 
 def lognRaise(msg):
 	logger.error(msg)
-	raise ValueError
+	raise ValueError(msg)
 
 
 
@@ -449,8 +816,22 @@ if __name__ == '__main__':
 
 			$python main.py 19437 20200529 --test
 
+		To see where the run spends its time, save the statistics to a file
+
+			$python main.py 19437 20200529 --stats stats.json
+
 		Before generating the final asset allocation report in step 6, go through
-		step 1 - 5 to make sure the blpData is ready.
+		step 1 - 5 to make sure the blpData is ready. To do all the checks of
+		step 1 - 5 (and step 1 of the liquidity report) in one go, do
+
+			$python main.py 19437 20200529 --validate
+
+		which writes the exception files instead of the liquidity report.
+
+		To go on when a position has no liquidity category, and write those
+		positions to an exception report, do
+
+			$python main.py 19437 20200529 --collect-errors
 	"""
 
 	import argparse
@@ -461,8 +842,18 @@ if __name__ == '__main__':
 					   , help='date of the positions (yyyymmdd)')
 	parser.add_argument( '--test', type=str, nargs='?', const=True, default=False
 					   , help='use test mode datastore')
+	parser.add_argument( '--stats', type=str, default=None
+					   , help='save timing and cache statistics of the run to a json file')
+	parser.add_argument( '--validate', action='store_true'
+					   , help='check the positions and write the exception files')
+	parser.add_argument( '--collect-errors', action='store_true'
+					   , help='write failed positions to an exception report instead of stopping')
 	args = parser.parse_args()
 
+	if args.stats:
+		import risk_report.instrument as instrument
+		instrument.enable()
+
 	mode = 'test' if args.test else 'production'
 	portfolio = args.portfolio
 	date = args.date
@@ -474,6 +865,9 @@ if __name__ == '__main__':
 	#
 	#####################################
 
+	# Step 1 - 5 below are done together by --validate (see writeValidationCsv()),
+	# they are kept here to run one step at a time.
+	#
 	# Step 1. Prepare the the BlpData_Template.xlsx for the portfolio positions.
 	# 
 	# 1) Create a file containing the (id, idtype) columns;
@@ -610,7 +1004,8 @@ if __name__ == '__main__':
 	# lqa response.
 	
 	# Step 1. Search for any securities that do not have a valid response from
-	# the LQA response file.
+	# the LQA response file. --validate writes them to the missing liquidity
+	# file of the portfolio.
 	# compose(
 	# 	print
 	#   , partial(writeCsv, 'MissingLiquidity_' + date + '.csv')
@@ -629,12 +1024,32 @@ if __name__ == '__main__':
 
 
 	# Step 3. Generate liquidity report.
-	compose(
-		print
-	  , partial(writeCsv, portfolio + '_liquidity_' + date + '.csv')
-	  , lambda rows: chain([('Category', 'Total', 'Percentage')], rows)
-	  , getLiquidityDistribution
-	)(portfolio, date, mode, 'USD')
+	if args.validate:
+		compose(
+			print
+		  , lambda result: \
+		  		'\n'.join(chain( result['Files']
+		  						, [ 'positions: {0}'.format(result['Positions'])
+		  						  , 'missing BlpData: {0}'.format(len(result['MissingBlpData']))
+		  						  , 'asset type errors: {0}'.format(len(result['AssetType']))
+		  						  , 'missing rating: {0}'.format(len(result['Rating']))
+		  						  , 'country errors: {0}'.format(len(result['Country']))
+		  						  , 'missing liquidity: {0}'.format(len(result['MissingLqa']))
+		  						  , 'cash total (USD): {0}'.format(result['Cash'])
+		  						  ]))
+		  , writeValidationCsv
+		)(portfolio, date, mode)
+
+	else:
+		compose(
+			print
+		  , writeLiquidityCsv
+		)(portfolio, date, mode, 'USD', args.collect_errors)
+
+
+	if args.stats:
+		import risk_report.data
+		instrument.dumpStats(args.stats, risk_report.data)
 
 
 	# For debugging purposes, indicate liquidity for each position
@@ -9,8 +9,9 @@ from risk_report.asset import isPrivateSecurity, isCash, isMoneyMarket \
 							, isRepo, isFxForward, getIdnType, getAssetType \
 							, getAverageRatingScore, getCountryCode \
 							, byCountryFilter, countryNotApplicable \
-							, toCountryGroup, fallsInAssetType \
+							, fallsInAssetType \
 							, getAverageRatingScore
+from risk_report.main import getAssetCountryAllocation
 from risk_report.sfc import readSfcTemplate
 from risk_report.data import getFX, getPortfolioPositions, getBlpData, getMarketValue \
 							, getBookCurrency, getLqaData, isCash, getLiquiditySpecialCaseData \
@@ -18,9 +19,7 @@ from risk_report.data import getFX, getPortfolioPositions, getBlpData, getMarket
 from utils.iter import pop
 from utils.utility import writeCsv, mergeDict, fromExcelOrdinal
 from toolz.functoolz import compose, juxt
-from toolz.itertoolz import groupby as groupbyToolz
-from toolz.dicttoolz import valmap
-from functools import partial, reduce
+from functools import partial
 from itertools import filterfalse, chain, takewhile
 from datetime import datetime
 from os.path import join
@@ -216,79 +215,6 @@ def writeAssetAllocationCsv(portfolio, date, mode, reportingCurrency, countryGro
 
 
 
-def getAssetTypeAllocation(date, blpData, assetTypeTuples, positions):
-	"""
-	[String] date (yyyymmdd),
-	[Dictionary] blpData,
-	[Iterator] assetTypeTuples,
-	[Iterator] positions
-		=> [Dictionary] assetypeTuple -> list of positions matching that 
-				asset type
-
-	Each position will be allocated to the first asset type it matches.
-	"""
-	def accumulate(acc, el):
-		for assetType in acc:
-			if fallsInAssetType(blpData, assetType, el):
-				acc[assetType] = chain(acc[assetType], [el])
-				break
-
-		return acc
-
-
-	return reduce( accumulate
-				 , positions
-				 , {assetType: [] for assetType in assetTypeTuples}
-				 )
-
-
-
-def getCountryGroupAllocation(date, blpData, countryGroups, positions):
-	"""
-	[String] date (yyyymmdd),
-	[Dictionary] blpData,
-	[Iterator] countryGroups,
-	[Iterator] positions
-		=> [Dictionary] country group -> list of positions in that country
-			group
-
-	Each position will be allocated to the first asset type it matches.
-	"""
-	def accumulate(acc, el):
-		cg = toCountryGroup(blpData, el)
-		try:
-			acc[cg] = chain(acc[cg], [el])
-		except KeyError:
-			pass
-
-		return acc
-
-
-	return reduce( accumulate
-				 , positions
-				 , {cg: [] for cg in countryGroups}
-				 )
-
-
-
-def getAssetCountryAllocation(date, blpData, assetTypeTuples, countryGroups, positions):
-	"""
-	[String] date (yyyymmdd),
-	[Dictionary] blpData,
-	[Iterator] assetTypeTuples,
-	[List] countryGroups,
-	[Iterator] positions
-		=> [Dictionary] assetypeTuple -> [Dictionary] countryGroup -> List of
-			positions that fall into this asset type and this country group
-	"""
-	return \
-	valmap( partial(getCountryGroupAllocation, date, blpData, countryGroups)
-		  , getAssetTypeAllocation(date, blpData, assetTypeTuples, positions)
-		  )
-
-
-
-
 def lognContinue(msg, x):
 	logger.debug(msg)
 	return x
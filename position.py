@@ -0,0 +1,172 @@
+# coding=utf-8
+#
+# A compact record for positions.
+#
+# Positions used to be the row dictionaries read from the input files, and
+# each enrichment (like adding 'Remarks1' or 'Id') copied the whole row with
+# mergeDict(). A Position keeps only the fields the reports use, in a tuple,
+# plus a source tag ('geneva' or 'bloomberg'). Enriching a position creates
+# a new Position that shares the tuple where possible.
+#
+# A Position is a read only Mapping, so the functions in geneva.py and blp.py
+# work on it the same way as on a dictionary. It also carries the accessor
+# table of its source, so that data.py does not check the source of a
+# position each time it reads it.
+#
+from risk_report.geneva import getGenevaPositionDate, getGenevaQuantity, getGenevaMarketValue \
+							, getGenevaBookCurrency, getGenevaIdnType, getGenevaPortfolioId \
+							, isGenevaPrivateSecurity, isGenevaCash, isGenevaMoneyMarket \
+							, isGenevaRepo, isGenevaFxForward, isGenevaFund
+from risk_report.blp import getBlpPositionDate, getBlpQuantity, getBlpMarketValue \
+							, getBlpBookCurrency, getBlpIdnType, getBlpPortfolioId \
+							, isBlpPrivateSecurity, isBlpCash, isBlpMoneyMarket \
+							, isBlpRepo, isBlpFxForward, isBlpFund
+from collections.abc import Mapping
+from itertools import chain
+
+
+
+"""
+	[String] source => [Tuple] fields kept for positions from the source
+"""
+positionFields = \
+{ 'geneva': ( 'Remarks1', 'Portfolio', 'PeriodEndDate', 'BookCurrency'
+			, 'SortKey', 'InvestID', 'Description', 'LocalCurrency'
+			, 'Quantity', 'MarketValueBook', 'AccruedInterest'
+			)
+, 'bloomberg': ( 'Remarks1', 'AsOfDate', 'Account Code', 'Name', 'ISIN'
+			   , 'Asset Type', 'Industry Sector', 'Currency', 'Position'
+			   , 'Market Value'
+			   )
+}
+
+
+
+""" [String] source => [Dictionary] field -> position in the tuple """
+fieldIndex = \
+{ source: { field: i for i, field in enumerate(fields) } \
+	for source, fields in positionFields.items()
+}
+
+
+
+"""
+	[String] source => [Dictionary] accessor name -> function of the source,
+		see data.sourceAccessor()
+"""
+accessorTables = \
+{ 'geneva': { 'getPositionDate': getGenevaPositionDate
+			, 'getQuantity': getGenevaQuantity
+			, 'getMarketValue': getGenevaMarketValue
+			, 'getBookCurrency': getGenevaBookCurrency
+			, 'getIdnType': getGenevaIdnType
+			, 'getPortfolioId': getGenevaPortfolioId
+			, 'isPrivateSecurity': isGenevaPrivateSecurity
+			, 'isCash': isGenevaCash
+			, 'isMoneyMarket': isGenevaMoneyMarket
+			, 'isRepo': isGenevaRepo
+			, 'isFxForward': isGenevaFxForward
+			, 'isFund': isGenevaFund
+			}
+, 'bloomberg': { 'getPositionDate': getBlpPositionDate
+			   , 'getQuantity': getBlpQuantity
+			   , 'getMarketValue': getBlpMarketValue
+			   , 'getBookCurrency': getBlpBookCurrency
+			   , 'getIdnType': getBlpIdnType
+			   , 'getPortfolioId': getBlpPortfolioId
+			   , 'isPrivateSecurity': isBlpPrivateSecurity
+			   , 'isCash': isBlpCash
+			   , 'isMoneyMarket': isBlpMoneyMarket
+			   , 'isRepo': isBlpRepo
+			   , 'isFxForward': isBlpFxForward
+			   , 'isFund': isBlpFund
+			   }
+}
+
+
+
+""" Value of a field that is not in the row """
+_missing = object()
+
+
+
+class Position(Mapping):
+	"""
+	A position from a source. Fields of the source are kept in a tuple (see
+	positionFields), other fields added later (like 'Id' and 'IdType' for
+	LQA) are kept in a small dictionary.
+
+	The accessor table of the source is resolved once, when the position is
+	created.
+	"""
+	__slots__ = ('source', 'accessors', 'values', 'extra')
+
+	def __init__(self, source, values, extra=None):
+		self.source = source
+		self.accessors = accessorTables[source]
+		self.values = values
+		self.extra = {} if extra == None else extra
+
+	def __getitem__(self, field):
+		if field in self.extra:
+			return self.extra[field]
+
+		value = self.values[fieldIndex[self.source][field]] \
+				if field in fieldIndex[self.source] else _missing
+		if value is _missing:
+			raise KeyError(field)
+
+		return value
+
+	def __iter__(self):
+		return chain( ( field for field, value in zip(positionFields[self.source], self.values) \
+						if value is not _missing)
+					, self.extra
+					)
+
+	def __len__(self):
+		return sum(1 for _ in self)
+
+	def __reduce__(self):
+		# rebuilt from its fields, because missing fields and the accessor
+		# table cannot be pickled
+		return (toPosition, (self.source, dict(self), self.extra))
+
+	def __repr__(self):
+		return 'Position({0}, {1})'.format(self.source, dict(self))
+
+
+
+def toPosition(source, row, fields={}):
+	"""
+	[String] source, [Dictionary] row, [Dictionary] fields to add or replace
+		=> [Position] position
+
+	Only the fields of the source are taken from the row, see positionFields.
+	"""
+	return \
+	withFields(
+		Position( source
+				, tuple(map(lambda field: row.get(field, _missing), positionFields[source])))
+	  , fields
+	)
+
+
+
+def withFields(position, fields):
+	"""
+	[Position] position, [Dictionary] fields to add or replace
+		=> [Position] a new position with the fields
+
+	The original position is not changed.
+	"""
+	index = fieldIndex[position.source]
+	extra = { field: value for field, value in fields.items() if not field in index }
+
+	return \
+	Position( position.source
+			, tuple(map( lambda t: fields.get(t[0], t[1])
+					   , zip(positionFields[position.source], position.values))) \
+			  if any(map(lambda field: field in index, fields)) else position.values
+			, {**position.extra, **extra} if len(extra) > 0 else position.extra
+			)
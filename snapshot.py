@@ -0,0 +1,91 @@
+# coding=utf-8
+#
+# Save the lines of a parsed Excel file to disk, so that the next time the
+# same file is read, we load the lines from the snapshot instead of decoding
+# the workbook again.
+#
+# A snapshot is identified by the file's absolute path, size and last
+# modified time, so when the Excel file changes, a new snapshot is created.
+#
+from risk_report.utility import getSnapshotDirectory
+from risk_report.instrument import countEvent
+from steven_utils.excel import fileToLines
+from os.path import abspath, join, exists
+from os import makedirs, replace, stat, getpid
+from hashlib import sha1
+import pickle
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def getSnapshotFile(file):
+	"""
+	[String] file => [String] snapshot file for the current version of the file
+	"""
+	fileStat = stat(file)
+
+	return \
+	join( getSnapshotDirectory()
+		, sha1('|'.join([ abspath(file)
+						, str(fileStat.st_size)
+						, str(fileStat.st_mtime_ns)
+						]).encode('utf-8')).hexdigest() + '.pickle'
+		)
+
+
+
+def loadSnapshot(snapshotFile):
+	"""
+	[String] snapshot file => [List] lines, or None if the snapshot does not
+		exist or cannot be read.
+	"""
+	if not exists(snapshotFile):
+		return None
+
+	try:
+		with open(snapshotFile, 'rb') as f:
+			return pickle.load(f)
+
+	except Exception:
+		logger.warning('loadSnapshot(): corrupted snapshot {0}'.format(snapshotFile))
+		return None
+
+
+
+def saveSnapshot(snapshotFile, lines):
+	"""
+	[String] snapshot file, [List] lines => [List] lines
+
+	Side effect: write the lines to the snapshot file. Write to a temporary
+	file first then rename, so that an interrupted run does not leave a half
+	written snapshot behind. The temporary file is per process, because
+	batch workers may save the snapshot of the same file at the same time.
+	"""
+	makedirs(getSnapshotDirectory(), exist_ok=True)
+	tempFile = snapshotFile + '.' + str(getpid()) + '.tmp'
+	with open(tempFile, 'wb') as f:
+		pickle.dump(lines, f, pickle.HIGHEST_PROTOCOL)
+
+	replace(tempFile, snapshotFile)
+	return lines
+
+
+
+def fileToLinesSnapshot(file):
+	"""
+	[String] file (Excel) => [Iterator] lines
+
+	The same as fileToLines(), except that the lines come from the snapshot
+	if the file has been read before.
+	"""
+	snapshotFile = getSnapshotFile(file)
+	lines = loadSnapshot(snapshotFile)
+	if lines is None:
+		logger.debug('fileToLinesSnapshot(): decode {0}'.format(file))
+		countEvent('snapshot miss')
+		lines = saveSnapshot(snapshotFile, list(map(list, fileToLines(file))))
+	else:
+		countEvent('snapshot hit')
+
+	return iter(lines)
@@ -2,7 +2,13 @@
 # 
 
 import unittest2
-from risk_report.asset import getAssetType, getAverageRatingScore, isInvestmentGrade
+from risk_report.asset import getAssetType, getAverageRatingScore, isInvestmentGrade \
+							, getClassification, fallsInAssetType, compileAssetTypePlan \
+							, routeAssetType \
+							, compileCountryPlan, routeCountryGroup, toCountryGroup \
+							, byCountryGroup, countryNotApplicable, classifyPositions
+from risk_report.sfc import readSfcTemplate
+from risk_report.utility import getCurrentDirectory
 from risk_report.main import ratingsApplicable
 from risk_report.data import getIdnType, getPortfolioPositions, getBlpData
 from itertools import filterfalse
@@ -70,6 +76,87 @@ class TestAsset(unittest2.TestCase):
 
 
 
+	def testClassification(self):
+		positions = list(getPortfolioPositions('19437', '20200429', 'test'))
+		blpData = getBlpData('20200429', 'test')
+
+		# The bond: T V2.875 PERP B
+		position = firstOf(lambda x: x['InvestID'] == 'XS2114413565', positions)
+		self.assertEqual( ('Fixed Income', 'Corporate')
+						, getAssetType(blpData, position))
+		self.assertTrue(isInvestmentGrade(blpData, position) is False)
+
+		record = getClassification(blpData, position)
+		self.assertEqual(('Fixed Income', 'Corporate'), record['AssetType'])
+		self.assertEqual(11, record['RatingScore'])
+		self.assertEqual(False, record['InvestmentGrade'])
+
+
+
+	def testRouteAssetType(self):
+		positions = list(getPortfolioPositions('19437', '20200429', 'test'))
+		blpData = getBlpData('20200429', 'test')
+		assetTypeTuples = list(readSfcTemplate(
+			join(getCurrentDirectory(), 'SFC_Asset_Allocation_Template.xlsx'))[1])
+		plan = compileAssetTypePlan(assetTypeTuples)
+
+		# The plan routes a position to the first asset type tuple it falls in
+		firstMatch = lambda p: \
+			firstOf(lambda t: fallsInAssetType(blpData, t, p), assetTypeTuples)
+
+		for p in positions:
+			self.assertEqual(firstMatch(p), routeAssetType(plan, blpData, p))
+
+
+
+	def testRouteCountryGroup(self):
+		blpData = getBlpData('20200429', 'test')
+		positions = list(filterfalse( partial(countryNotApplicable, blpData)
+									, getPortfolioPositions('19437', '20200429', 'test')))
+		countryGroups = readSfcTemplate(
+			join(getCurrentDirectory(), 'SFC_Asset_Allocation_Template.xlsx'))[0]
+		plan = compileCountryPlan(countryGroups)
+
+		# a position goes to the column of its country group, if it is there
+		for p in positions:
+			column = routeCountryGroup(plan, blpData, p)
+			self.assertEqual( toCountryGroup(blpData, p) if toCountryGroup(blpData, p) in countryGroups else None
+							, plan['CountryGroups'][column] if column >= 0 else None)
+
+		# byCountryGroup still matches the country group by prefix
+		for countryGroup in countryGroups:
+			self.assertEqual(
+				list(filter( lambda p: countryGroup.lower().startswith(toCountryGroup(blpData, p).lower())
+						   , positions))
+			  , list(byCountryGroup(blpData, countryGroup, positions))
+			)
+
+
+
+	def testClassifyPositions(self):
+		blpData = getBlpData('20200429', 'test')
+		positions = list(getPortfolioPositions('19437', '20200429', 'test'))
+
+		classifications, report = classifyPositions(blpData, positions, True)
+		self.assertEqual({}, report)
+		for p, classification in zip(positions, classifications):
+			self.assertEqual(getAssetType(blpData, p), classification['AssetType'])
+			self.assertEqual( None if countryNotApplicable(blpData, p) else toCountryGroup(blpData, p)
+							, classification['CountryGroup'])
+
+		# without BlpData, the failures are collected instead of raised
+		emptyBlpData = {}
+		self.assertRaises(Exception, classifyPositions, emptyBlpData, positions)
+
+		classifications, report = classifyPositions(emptyBlpData, positions, True)
+		self.assertEqual(len(positions), len(classifications))
+		self.assertTrue(len(report) > 0)
+		for classification in filter(lambda c: c['AssetType'] == None, classifications):
+			self.assertTrue('AssetType' in classification['Errors'])
+			self.assertEqual(None, classification['CountryGroup'])
+
+
+
 	def testAverageRating(self):
 		positions = getPortfolioPositions('19437', '20200429', 'test')
 		blpData = getBlpData('20200429', 'test')
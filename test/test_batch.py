@@ -0,0 +1,61 @@
+# coding=utf-8
+#
+
+import unittest2
+from risk_report.batch import runBatch, getChunks, getAllAccounts
+from risk_report.data import getBlpAccounts
+from itertools import chain
+from os import chdir, getcwd
+from tempfile import TemporaryDirectory
+
+
+
+class TestBatch(unittest2.TestCase):
+
+	def __init__(self, *args, **kwargs):
+		super(TestBatch, self).__init__(*args, **kwargs)
+
+
+
+	def testRunBatch(self):
+		currentDirectory = getcwd()
+		with TemporaryDirectory() as directory:
+			chdir(directory)
+			try:
+				results = runBatch(['19437'], ['20200529'], 'test')
+			finally:
+				chdir(currentDirectory)
+
+		self.assertEqual(
+			[ ('20200529', '19437', 'allocation', '19437_asset_allocation_20200529.csv')
+			, ('20200529', '19437', 'liquidity', '19437_liquidity_20200529.csv')
+			]
+		  , results
+		)
+
+
+
+	def testGetAllAccounts(self):
+		# 60001 has no Geneva file on the date, so its Bloomberg accounts are run
+		accounts = getAllAccounts('20200529', 'test')
+		self.assertEqual('19437', accounts[0])
+		self.assertFalse('60001' in accounts)
+		self.assertEqual( list(filter( lambda account: not account.startswith('19437')
+									 , getBlpAccounts('20200529', 'test')))
+						, accounts[1:])
+
+
+
+	def testGetChunks(self):
+		jobs = [ (date, portfolio, 'liquidity') \
+					for date in ['20210331', '20210630'] \
+					for portfolio in ['19437', '60001', '60002', '60003', '60004']]
+
+		chunks = getChunks(jobs, 2)
+
+		# the jobs of a date are split into at most 2 chunks
+		self.assertEqual([3, 2, 3, 2], list(map(len, chunks)))
+
+		# a chunk has jobs of one date only, and the jobs are in order
+		self.assertTrue(all(map(lambda chunk: len(set(map(lambda job: job[0], chunk))) == 1, chunks)))
+		self.assertEqual(jobs, list(chain.from_iterable(chunks)))
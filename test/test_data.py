@@ -4,11 +4,18 @@
 import unittest2
 from risk_report.data import getPortfolioPositions, getPositionDate, getBookCurrency \
 							, getIdnType, getMarketValue, getPortfolioId, getQuantity \
-							, getLqaData
+							, getLqaData, getAllPositionsBlp, getFX, getLqaColumns \
+							, getSecurityMaster, getMissingData, getBlpData, readLqaColumns
 from risk_report.geneva import isGenevaPosition
+from risk_report.position import withFields
+from risk_report.lqa import getIncrementalLqaPositions
+from risk_report.utility import getInputDirectory, setInputDirectory, setLqaStoreDirectory
 from toolz.functoolz import compose
 from functools import partial
 from itertools import filterfalse
+from tempfile import TemporaryDirectory
+from os.path import join
+from shutil import copyfile
 
 
 
@@ -19,6 +26,12 @@ class TestGeneva(unittest2.TestCase):
 
 
 
+	def tearDown(self):
+		setInputDirectory('test_incremental', None)
+		setLqaStoreDirectory('test_incremental', None)
+
+
+
 	def testGetPortfolioPositions(self):
 		# Test Geneva positions
 		positions = list(getPortfolioPositions('19437', '20200429', 'test'))
@@ -38,6 +51,43 @@ class TestGeneva(unittest2.TestCase):
 
 
 
+	def testGetBlpPositions(self):
+		# Positions of one Bloomberg account come from the account index
+		positions = list(getPortfolioPositions('12734', '20200131', 'test'))
+		self.assertEqual( len(positions)
+						, compose(
+							len
+						  , list
+						  , partial(filter, lambda p: getPortfolioId(p) == '12734')
+						)(getAllPositionsBlp('20200131', 'test')))
+		self.assertEqual([], list(getPortfolioPositions('99999', '20200131', 'test')))
+
+
+
+	def testPositionRecord(self):
+		# Enriching a position does not copy or change the original
+		p = list(getPortfolioPositions('19437', '20200429', 'test'))[3]
+		q = withFields(p, {'Id': '1299 HK Equity', 'Quantity': 100})
+		self.assertEqual('geneva', p.source)
+		self.assertEqual(177200, getQuantity(p))
+		self.assertEqual(100, getQuantity(q))
+		self.assertEqual('1299 HK Equity', q['Id'])
+		self.assertFalse('Id' in p)
+
+
+
+	def testGetFX(self):
+		usdFX = getFX('20200429', 'USD')
+		self.assertEqual(1.0, usdFX['USD'])
+
+		# the same rates with HKD as reporting currency, either from the
+		# file or derived from the USD rates
+		hkdFX = getFX('20200429', 'HKD')
+		self.assertEqual(1.0, hkdFX['HKD'])
+		self.assertAlmostEqual(1/usdFX['HKD'], hkdFX['USD'], 6)
+
+
+
 	def testGetLqaData(self):
 		d = getLqaData('20200529', 'test')
 		self.assertEqual(171, len(d))
@@ -45,6 +95,104 @@ class TestGeneva(unittest2.TestCase):
 
 
 
+	def testGetLqaColumns(self):
+		lqaColumns = getLqaColumns('20200529', 'test')
+		row = lqaColumns['Index']['1299 HK Equity']
+		self.assertEqual(0.2, lqaColumns['Columns']['LQA_LIQUIDATION_HORIZON'][row])
+
+		# a number column with no data, the original string is kept
+		d = getLqaData('20200529', 'test')
+		self.assertEqual('N.A.', d['XS2180908001']['LQA_LIQUIDATION_HORIZON'])
+		self.assertEqual(0, d['XS2180908001']['ERROR CODE'])
+
+
+
+	def testLqaOtherColumns(self):
+		# a column that is not a known number column is converted to a float
+		# if it looks like one, as getLqaData() always did
+		with TemporaryDirectory() as directory:
+			file = join(directory, 'LqaData_20200529.bbg')
+			with open(file, 'w') as f:
+				f.write('START-OF-FILE\nSTART-OF-DATA\n'
+						'SECURITIES|ERROR CODE|LQA_POSITION_TAG_1|LQA_LIQUIDITY_SECTOR|\n'
+						'1299 HK Equity|0|19437|Developed APAC|\n'
+						'9988 HK Equity|0|"masterlist"|Developed APAC|\n'
+						'END-OF-DATA\nEND-OF-FILE\n')
+
+			lqaColumns = readLqaColumns(file)
+
+		self.assertEqual([19437.0, 'masterlist'], lqaColumns['Columns']['LQA_POSITION_TAG_1'])
+		self.assertEqual( ['Developed APAC', 'Developed APAC']
+						, lqaColumns['Columns']['LQA_LIQUIDITY_SECTOR'])
+
+
+
+	def testGetSecurityMaster(self):
+		securityMaster = getSecurityMaster('20200529', 'test')
+		record = securityMaster['1299 HK Equity']
+		self.assertEqual(0.2, record.liquidationHorizon)
+		self.assertEqual(record.blpData['ID'], record['ID'])
+
+		self.assertEqual(
+			{'NO SUCH ID': ['BlpData', 'LQA']}
+		  , getMissingData(securityMaster, ['1299 HK Equity', 'NO SUCH ID'])
+		)
+
+
+
+	def testSkippedLiquidationHorizon(self):
+		# a security left out of the incremental LQA request of a date takes
+		# the horizon of the response it was left out for
+		with TemporaryDirectory() as directory, TemporaryDirectory() as storeDirectory:
+			setInputDirectory('test_incremental', directory)
+			setLqaStoreDirectory('test_incremental', storeDirectory)
+			copyfile( join(getInputDirectory('test'), 'BlpData_20200529.xlsx')
+					, join(directory, 'BlpData_20200615.xlsx'))
+			copyfile( join(getInputDirectory('test'), 'LqaData_20200529.bbg')
+					, join(directory, 'LqaData_20200529.bbg'))
+
+			self.assertEqual(
+				[]
+			  , getIncrementalLqaPositions( '20200615', 'test_incremental', 30, 0.05
+			  							  , [{'Id': '1299 HK Equity', 'Position': 177200}])
+			)
+
+			# the response of the date has neither 1299 HK Equity (left out)
+			# nor 9988 HK Equity (not in the request)
+			with open(join(directory, 'LqaData_20200529.bbg')) as f:
+				lines = f.read().split('\n')
+			with open(join(directory, 'LqaData_20200615.bbg'), 'w') as f:
+				f.write('\n'.join(filter( lambda L: not L.startswith('1299 HK Equity|') \
+											and not L.startswith('9988 HK Equity|')
+										 , lines)))
+
+			securityMaster = getSecurityMaster('20200615', 'test_incremental')
+
+		self.assertEqual(0.2, securityMaster['1299 HK Equity'].liquidationHorizon)
+		self.assertEqual(
+			{'9988 HK Equity': ['LQA']}
+		  , getMissingData(securityMaster, ['1299 HK Equity', '9988 HK Equity'])
+		)
+
+
+
+	def testRatingRecord(self):
+		blpData = getBlpData('20200529', 'test')
+
+		# rated by all 3 agencies, the average is the middle score
+		record = blpData['US404280AG49']['RatingRecord']
+		self.assertEqual(3, len(list(filter(lambda x: x > 0, record.scores))))
+		self.assertTrue(all(map(lambda code: code > 0, record.codes)))
+		self.assertEqual(sorted(record.scores)[1], record.average)
+
+		# no rating
+		record = blpData['6808 HK Equity']['RatingRecord']
+		self.assertEqual((0, 0, 0), record.codes)
+		self.assertEqual((0, 0, 0), record.scores)
+		self.assertEqual(None, record.average)
+
+
+
 	def verifyLQAdata(self, p):
 		self.assertEqual(0, p['ERROR CODE'])
 		self.assertEqual('1299 HK Equity', p['SECURITIES'])
@@ -2,13 +2,17 @@
 # 
 
 import unittest2
-from risk_report.lqa import createLqaPositions
+from risk_report.lqa import createLqaPositions, consolidate, buildLqaRequestShards \
+							, getLatestLqaResponses, getIncrementalLqaPositions
 from risk_report.data import getPositionDate
-from risk_report.utility import getCurrentDirectory
+from risk_report.utility import getCurrentDirectory, setLqaStoreDirectory
 from functools import partial
+from itertools import chain
 from utils.iter import firstOf
 from toolz.functoolz import compose
 from os.path import join
+from os import chdir, getcwd
+from tempfile import TemporaryDirectory
 
 
 
@@ -18,7 +22,7 @@ findById = lambda id, positions: \
 
 
 findByName = lambda name, positions: \
-	firstOf(lambda p: p['Name'] == name, positions)
+	firstOf(lambda p: p.get('Name') == name, positions)
 
 
 
@@ -29,6 +33,19 @@ class TestLqa(unittest2.TestCase):
 
 
 
+	def setUp(self):
+		# keep the LQA store of the tests out of the module's folder
+		self.storeDirectory = TemporaryDirectory()
+		setLqaStoreDirectory('test', self.storeDirectory.name)
+
+
+
+	def tearDown(self):
+		setLqaStoreDirectory('test', None)
+		self.storeDirectory.cleanup()
+
+
+
 	def testLqaPositions(self):
 		nonCLO, clo = compose(
 			lambda t: (list(t[0]), list(t[1]))
@@ -64,6 +81,94 @@ class TestLqa(unittest2.TestCase):
 
 
 
+	def testConsolidateAgain(self):
+		# consolidated positions keep their quantity when consolidated again
+		nonCLO, clo = compose(
+			lambda t: (list(t[0]), list(t[1]))
+		  , createLqaPositions
+		)('all', '20200131', 'test')
+
+		positions = list(consolidate(chain(nonCLO, clo)))
+		self.assertEqual( len(set(map(lambda p: p['Id'], chain(nonCLO, clo))))
+						, len(positions))
+		self.verifyCLOPosition(findByName('AEGON 5 ½ 04/11/48', positions))
+		self.verifyNonCLOPosition(findByName('CHINSC 8 ¾ 01/15/21', positions))
+
+
+
+	def testLqaRequestShards(self):
+		positions = [ {'Id': '{0} HK Equity'.format(i), 'IdType': 'TICKER', 'Position': 100} \
+						for i in range(5)] \
+				  + [{'Id': 'XS000000000{0}'.format(i), 'IdType': 'ISIN', 'Position': 200} \
+				  		for i in range(2)]
+
+		currentDirectory = getcwd()
+		with TemporaryDirectory() as directory:
+			chdir(directory)
+			try:
+				manifest = buildLqaRequestShards('masterlist', '2020-05-29', positions, 2, True)
+				with open(manifest) as f:
+					lines = f.read().split()
+
+				with open('LQA_request_masterlist_TICKER_2020-05-29_3.txt') as f:
+					lastShard = f.read().split('\n')
+			finally:
+				chdir(currentDirectory)
+
+		self.assertEqual(5, len(lines))		# header + 3 TICKER shards + 1 ISIN shard
+		self.assertEqual('LQA_request_masterlist_ISIN_2020-05-29_1.txt,ISIN,2', lines[1])
+		self.assertEqual(1, len(lastShard))
+		self.assertTrue(lastShard[0].startswith('4 HK Equity, TICKER'))
+
+
+
+	def testLqaRequestShardOrder(self):
+		# shards are listed in the order of their number, not as text
+		positions = [ {'Id': '{0} HK Equity'.format(i), 'IdType': 'TICKER', 'Position': 100} \
+						for i in range(12)]
+
+		currentDirectory = getcwd()
+		with TemporaryDirectory() as directory:
+			chdir(directory)
+			try:
+				manifest = buildLqaRequestShards('masterlist', '2020-05-29', positions, 1)
+				with open(manifest) as f:
+					lines = f.read().split()
+			finally:
+				chdir(currentDirectory)
+
+		self.assertEqual(
+			list(map( lambda n: 'LQA_request_masterlist_2020-05-29_{0}.txt,,1'.format(n)
+					, range(1, 13)))
+		  , lines[1:]
+		)
+
+
+
+	def testIncrementalLqaPositions(self):
+		responses = getLatestLqaResponses('20200615', 'test')
+		self.assertEqual(('20200529', 177200), responses['1299 HK Equity'])
+		self.assertFalse('XS2180908001' in responses)	# no liquidation horizon
+
+		positions = [ {'Id': '1299 HK Equity', 'Position': 180000}
+					, {'Id': '1299 HK Equity', 'Position': 200000}
+					, {'Id': 'XS2180908001', 'Position': 1000000}
+					]
+
+		self.assertEqual(
+			[200000, 1000000]
+		  , list(map( lambda p: p['Position']
+		  			, getIncrementalLqaPositions('20200615', 'test', 30, 0.05, positions)))
+		)
+
+		# the response is too old
+		self.assertEqual(
+			3
+		  , len(list(getIncrementalLqaPositions('20200801', 'test', 30, 0.05, positions)))
+		)
+
+
+
 	def verifyCLOPosition(self, p):
 		self.assertEqual('US007924AJ23', p['Id'])
 		self.assertEqual('ISIN', p['IdType'])
@@ -0,0 +1,52 @@
+# coding=utf-8
+# 
+
+import unittest2
+from risk_report.lqa_store import openLqaStore, ingestLqaResponses, getLqaResponse \
+								, getLiquidationHorizons, getLatestAnswers, saveSkippedSecurities \
+								, getSkippedHorizons
+from tempfile import TemporaryDirectory
+from os.path import join
+
+
+
+class TestLqaStore(unittest2.TestCase):
+
+	def __init__(self, *args, **kwargs):
+		super(TestLqaStore, self).__init__(*args, **kwargs)
+
+
+
+	def testLqaStore(self):
+		with TemporaryDirectory() as directory:
+			connection = openLqaStore('test', join(directory, 'lqa_store_test.db'))
+			try:
+				self.assertEqual(['20200529'], ingestLqaResponses(connection, 'test'))
+				self.assertEqual([], ingestLqaResponses(connection, 'test'))	# loaded once
+
+				response = getLqaResponse(connection, '1299 HK Equity', '20200529')
+				self.assertEqual(0.2, response['liquidation_horizon'])
+				self.assertEqual(177200, response['tgt_liquidation_volume'])
+				self.assertEqual('Developed APAC', response['liquidity_sector'])
+				self.assertEqual(None, getLqaResponse(connection, '1299 HK Equity', '20200430'))
+
+				# 'N.A.' is saved as None
+				self.assertEqual( [('20200529', None)]
+								, getLiquidationHorizons(connection, 'XS2180908001'))
+
+				answers = getLatestAnswers(connection, '20200615')
+				self.assertEqual(('20200529', 177200), answers['1299 HK Equity'])
+				self.assertFalse('XS2180908001' in answers)
+				self.assertEqual({}, getLatestAnswers(connection, '20200528'))
+
+				# the horizon of the response a security was left out for
+				self.assertEqual(
+					1
+				  , saveSkippedSecurities( connection, '20200615'
+										 , [('1299 HK Equity', '20200529')])
+				)
+				self.assertEqual( {'1299 HK Equity': 0.2}
+								, getSkippedHorizons(connection, '20200615'))
+				self.assertEqual({}, getSkippedHorizons(connection, '20200616'))
+			finally:
+				connection.close()
@@ -4,8 +4,12 @@
 
 import unittest2
 from risk_report.main import marketValueWithFX, getLiquidityCategory \
-							, getTotalMarketValueFromCountrynAssetType
-from risk_report.data import getFX, getPortfolioPositions, getBlpData, getLqaData
+							, getTotalMarketValueFromCountrynAssetType, getLiquidityCategories \
+							, getAssetCountryTotals, validatePositions \
+							, getFISecuritiesWoRatings, getTotalMarketValueFromAssetType
+from risk_report.data import getFX, getPortfolioPositions, getBlpData, getSecurityMaster \
+							, SecurityRecord
+from risk_report.asset import getSecurityKey
 from toolz.functoolz import compose
 from functools import partial
 from os.path import join
@@ -17,9 +21,7 @@ compose(
 	list
   , partial( map
   		   , lambda p: ( getLiquidityCategory( date
-  		   			   						 , mode
-  		   			   						 , getBlpData(date, mode)
-  		   			   						 , getLqaData(date, mode)
+  		   			   						 , getSecurityMaster(date, mode)
   		   			   						 , p)
   		   			   , marketValueWithFX(getFX(date, 'USD'), p)
   		   			   ))
@@ -69,6 +71,20 @@ class TestMain(unittest2.TestCase):
 
 
 
+	def testLiquidityCategories(self):
+		# The batch version gives the same category for each position
+		date, mode = '20200630', 'production'
+		positions = list(getPortfolioPositions('19437', date, mode))
+		securityMaster = getSecurityMaster(date, mode)
+
+		self.assertEqual(
+			list(map( partial(getLiquidityCategory, date, securityMaster)
+					, positions))
+		  , getLiquidityCategories(date, securityMaster, positions)
+		)
+
+
+
 	def testDIF20200930Liquidity(self):
 		"""
 		on 2020-09-30, DIF liquidity involves no special case and no override.
@@ -149,6 +165,72 @@ class TestMain(unittest2.TestCase):
 
 
 
+	def testAssetCountryTotals(self):
+		# The running totals give the same market value as filtering positions
+		date = '20200630'
+		mode = 'production'
+		totals = getAssetCountryTotals(
+					date, getBlpData(date, mode), 'USD'
+				  , [ ('Equity', 'Listed equities', 'Financial Institution')
+				  	, ('Fund', 'Exchange Traded Funds', 'SFC authorized')
+				  	]
+				  , ['China - Mainland', 'China - Hong Kong']
+				  , getPortfolioPositions('19437', date, mode))
+
+		self.assertAlmostEqual( 5567210.01
+							  , totals[('Equity', 'Listed equities', 'Financial Institution')]['China - Mainland']
+							  , 2)
+		self.assertAlmostEqual( 1002490.16
+							  , totals[('Fund', 'Exchange Traded Funds', 'SFC authorized')]['China - Hong Kong']
+							  , 2)
+
+
+
+	def testCollectErrors(self):
+		# without LQA data, the positions that need it are reported, not raised
+		date, mode = '20200529', 'test'
+		positions = list(getPortfolioPositions('19437', date, mode))
+		securityMaster = { securityId: SecurityRecord( r.blpData, None, r.assetTypeSpecialCase
+													 , r.liquiditySpecialCase, r.liquidityOverride) \
+							for securityId, r in getSecurityMaster(date, mode).items()}
+
+		report = {}
+		categories = getLiquidityCategories(date, securityMaster, positions, report)
+		self.assertTrue(len(report) > 0)
+		self.assertRaises(ValueError, getLiquidityCategories, date, securityMaster, positions)
+		for position, category in zip(positions, categories):
+			if category == None:
+				self.assertTrue(getSecurityKey(position) in report)
+
+		# without BlpData, the positions that need it are reported
+		report = {}
+		getAssetCountryTotals( date, {}, 'USD', [('Equity', )], ['China - Hong Kong']
+							 , positions, report)
+		self.assertTrue(len(report) > 0)
+		self.assertTrue(all(map(lambda errors: 'AssetType' in errors, report.values())))
+
+
+
+	def testValidatePositions(self):
+		# The single pass finds the same problems as the steps one at a time
+		date = '20200630'
+		mode = 'production'
+		blpData = getBlpData(date, mode)
+		positions = list(getPortfolioPositions('19437', date, mode))
+		result = validatePositions(date, mode, positions)
+
+		self.assertEqual(len(positions), result['Positions'])
+		self.assertEqual(0, len(result['AssetType']))
+		self.assertEqual(0, len(result['Country']))
+		self.assertEqual( set(getFISecuritiesWoRatings(blpData, positions))
+						, result['Rating'])
+		self.assertAlmostEqual( getTotalMarketValueFromAssetType( date, positions, blpData
+																, 'USD', 'Cash')
+							  , result['Cash']
+							  , 2)
+
+
+
 	def testDIF20200930AssetAllocation(self):
 		"""
 		on 2020-09-30, we test again.
@@ -31,8 +31,35 @@ def loadConfigFile(file):
 
 
 
+"""
+	Input directories set at run time, mode -> directory. They take precedence
+	over the config file, see setInputDirectory().
+"""
+_inputDirectories = {}
+
+
+
+def setInputDirectory(mode, directory):
+	"""
+	[String] mode, [String] directory => [String] directory
+
+	Use the directory as the input directory of the mode. The benchmark uses
+	it to point a mode to the synthetic data it generates. None means the
+	input directory in the config file again.
+	"""
+	if directory == None:
+		_inputDirectories.pop(mode, None)
+	else:
+		_inputDirectories[mode] = directory
+
+	return directory
+
+
+
 def getInputDirectory(mode):
-	if mode == 'test':
+	if mode in _inputDirectories:
+		return _inputDirectories[mode]
+	elif mode == 'test':
 		return loadConfigFile('risk_report.config')['Test']['inputDirectory']
 	else:
 		return loadConfigFile('risk_report.config')['Production']['inputDirectory']
@@ -40,4 +67,56 @@ def getInputDirectory(mode):
 
 
 def getDataDirectory():
-	return loadConfigFile('risk_report.config')['Data']['directory']
\ No newline at end of file
+	return loadConfigFile('risk_report.config')['Data']['directory']
+
+
+
+def getSnapshotDirectory():
+	"""
+	Where the parsed input files are saved, see snapshot.py. If not specified
+	in the config file, use the 'snapshots' folder under this module.
+	"""
+	return loadConfigFile('risk_report.config')['Data'].get(
+		'snapshotDirectory'
+	  , join(getCurrentDirectory(), 'snapshots')
+	)
+
+
+
+"""
+	LQA store directories set at run time, mode -> directory. They take
+	precedence over the config file, see setLqaStoreDirectory().
+"""
+_lqaStoreDirectories = {}
+
+
+
+def setLqaStoreDirectory(mode, directory):
+	"""
+	[String] mode, [String] directory => [String] directory
+
+	Save the LQA store of the mode in the directory, the tests use it to keep
+	their stores out of this module's folder. None means the LQA store
+	directory in the config file again.
+	"""
+	if directory == None:
+		_lqaStoreDirectories.pop(mode, None)
+	else:
+		_lqaStoreDirectories[mode] = directory
+
+	return directory
+
+
+
+def getLqaStoreDirectory(mode):
+	"""
+	Where the LQA response stores are saved, see lqa_store.py. If not
+	specified in the config file, use the 'lqa_store' folder under this module.
+	"""
+	if mode in _lqaStoreDirectories:
+		return _lqaStoreDirectories[mode]
+
+	return loadConfigFile('risk_report.config')['Data'].get(
+		'lqaStoreDirectory'
+	  , join(getCurrentDirectory(), 'lqa_store')
+	)